@@ -0,0 +1,260 @@
+'''
+    Pipelined frame acquisition.
+
+    AcquisitionThread keeps the device FIFO drained on its own thread while the consumer
+    processes and sends earlier frames. It cycles through a small pool of preallocated SDK
+    Frame handles; the ctypes call in Device.get_next_frame goes through CDLL, which releases
+    the GIL for the duration of the blocking call, so processing on other threads overlaps
+    with the wait for the next frame.
+
+    Consumers receive AcquiredFrame objects holding read-only numpy views on the SDK frame
+    memory. The Frame handle goes back to the pool when the consumer calls release(), so
+    views must not be used after that. If the consumer holds on to every frame, the oldest
+    frame that is not being consumed is recycled and counted as dropped rather than stalling
+    the device.
+
+    If the device FIFO overflows because frames were not read in time, OverflowRecovery
+    restarts the acquisition with the device configuration and carries on. The sequence
+    number skips the frames lost meanwhile, so consumers see the gap, and every gap is
+    recorded. Overflows that keep coming back (less than clean_frames frames apart) are
+    retried with an exponentially growing delay, so a sustained overload backs off instead
+    of restarting the device at once on every overflow. The error is raised once
+    max_consecutive restarts in a row failed without a frame read in between.
+'''
+from collections import deque
+from threading import Condition, Thread
+import time
+import timestamps
+from radar_tools import FIFO_OVERFLOW_ERROR
+from telemetry import PIPELINE
+
+def is_fifo_overflow(error):
+    # matched by error code: ifxRadarSDK.RadarSDKFifoOverflowError and the simulator's
+    # FifoOverflowError, which is not an SDK class, both carry it
+    return getattr(error, "error", None) == FIFO_OVERFLOW_ERROR
+
+class OverflowRecovery:
+    def __init__(self, device, config=None, min_backoff=0.01, max_backoff=1.0, max_consecutive=8, clean_frames=16, history=100):
+        '''
+            config is the Device.set_config keyword dict used to restart the acquisition,
+            without it the device is only read again. The backoff is reset after clean_frames
+            frames without an overflow. history is the number of gaps kept.
+        '''
+        self.device = device
+        self.config = config
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.max_consecutive = max_consecutive
+        self.clean_frames = clean_frames
+        self.frame_period = None
+        self.measure_period = True
+        if config and config.get("frame_period_us"):
+            self.frame_period = 1.0e-6 * config["frame_period_us"]
+            self.measure_period = False
+        self.last_timestamp = None
+        self.consecutive = 0 # overflows without a frame read in between
+        self.backoff_level = 0 # overflows less than clean_frames frames apart
+        self.clean = 0 # frames read since the last overflow
+        self.overflow_time = None
+        self.overflows = 0
+        self.lost_frames = 0
+        self.gaps = deque(maxlen=history)
+
+    def read(self, frame, sequence):
+        '''
+            Reads the next frame into frame, recovering from FIFO overflows. sequence is the
+            number of the next frame if none is lost. Returns (sequence, timestamp) of the
+            frame read.
+        '''
+        while True:
+            try:
+                with PIPELINE.timer("device_wait"):
+                    self.device.get_next_frame(frame)
+                break
+            except Exception as e:
+                if not is_fifo_overflow(e):
+                    raise
+                self.resync(e)
+        timestamp = timestamps.now()
+
+        if self.overflow_time is not None:
+            lost = self.frames_lost(timestamp)
+            self.gaps.append({"sequence": sequence, "lost": lost, "timestamp": self.overflow_time})
+            self.lost_frames += lost
+            PIPELINE.count("lost_frames_total", lost)
+            sequence += lost
+            self.overflow_time = None
+        elif self.measure_period and self.last_timestamp is not None:
+            # no frame period configured, estimate it from the frames read
+            interval = timestamp - self.last_timestamp
+            self.frame_period = interval if self.frame_period is None else 0.9 * self.frame_period + 0.1 * interval
+        self.last_timestamp = timestamp
+        self.consecutive = 0
+        self.clean += 1
+        if self.clean >= self.clean_frames:
+            self.backoff_level = 0
+        return sequence, timestamp
+
+    def resync(self, error):
+        self.overflows += 1
+        PIPELINE.count("fifo_overflows_total")
+        self.consecutive += 1
+        self.backoff_level += 1
+        self.clean = 0
+        if self.overflow_time is None:
+            self.overflow_time = timestamps.now()
+        if self.consecutive > self.max_consecutive:
+            raise error
+        if self.backoff_level > 1:
+            time.sleep(self.backoff())
+        print("FIFO overflow, restarting the acquisition")
+        if self.config is not None:
+            self.device.set_config(**self.config)
+
+    def backoff(self):
+        '''
+            Delay [s] before the next restart, doubling with every overflow that follows
+            the last one within clean_frames frames
+        '''
+        return min(self.max_backoff, self.min_backoff * 2 ** (self.backoff_level - 2))
+
+    def frames_lost(self, timestamp):
+        '''
+            Estimate of the frames lost between the last frame before the overflow and the
+            first one after it, at least 1
+        '''
+        if self.last_timestamp is None or not self.frame_period:
+            return 1
+        return max(1, int(round((timestamp - self.last_timestamp) / self.frame_period)) - 1)
+
+    def stats(self):
+        return {
+            "overflows": self.overflows,
+            "backoff": self.backoff() if self.backoff_level > 1 else 0.0,
+            "lost_frames": self.lost_frames,
+            "gaps": list(self.gaps),
+        }
+
+class AcquiredFrame:
+    def __init__(self, pool, handle, matrices, sequence, timestamp):
+        self.pool = pool
+        self.handle = handle
+        self.matrices = matrices
+        self.sequence = sequence
+        self.timestamp = timestamp
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def release(self):
+        if self.pool is not None:
+            self.pool.recycle(self.handle)
+            self.pool = None
+
+class AcquisitionThread(Thread):
+    def __init__(self, device, pool_size=4, first_sequence=0, recovery=None):
+        '''
+            recovery is the OverflowRecovery of device, a new one that cannot restart the
+            acquisition is used if None
+        '''
+        super().__init__(daemon=True)
+        if pool_size < 2:
+            raise ValueError("The frame pool needs at least 2 frames")
+        self.device = device
+        self.pool_size = pool_size
+        self.recovery = recovery or OverflowRecovery(device)
+
+        # the matrix memory of an SDK frame does not move, so views are created once per handle
+        self.frames = []
+        self.views = {}
+        for _ in range(pool_size):
+            frame = device.create_frame_from_device_handle()
+            views = []
+            for rx in range(frame.get_num_rx()):
+                view = frame.get_mat_from_antenna(rx, copy=False)
+                view.setflags(write=False)
+                views.append(view)
+            self.frames.append(frame)
+            self.views[id(frame)] = views
+
+        self.free = deque(self.frames)
+        self.ready = deque()
+        self.condition = Condition()
+        self.running = True
+        self.error = None
+        self.sequence = first_sequence
+        self.acquired = 0
+        self.dropped = 0
+
+    def run(self):
+        try:
+            while self.running:
+                frame = self.take_free_frame()
+                try:
+                    sequence, timestamp = self.recovery.read(frame, self.sequence)
+                except Exception:
+                    self.recycle(frame)
+                    raise
+                with self.condition:
+                    self.ready.append((frame, sequence, timestamp))
+                    self.sequence = sequence + 1
+                    self.acquired += 1
+                    self.condition.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self.condition:
+                self.running = False
+                self.condition.notify_all()
+
+    def take_free_frame(self):
+        with self.condition:
+            if self.free:
+                return self.free.popleft()
+            if self.ready:
+                frame, _, _ = self.ready.popleft()
+                self.dropped += 1
+                PIPELINE.count("acquisition_dropped_total")
+                return frame
+            # every frame is held by the consumer
+            self.condition.wait_for(lambda: self.free or not self.running)
+            if not self.free:
+                raise RuntimeError("Acquisition stopped")
+            return self.free.popleft()
+
+    def recycle(self, frame):
+        with self.condition:
+            self.free.append(frame)
+            self.condition.notify_all()
+
+    def get(self, timeout=None):
+        '''
+            Returns the oldest acquired frame as an AcquiredFrame. Raises the acquisition error
+            if the thread died, or TimeoutError.
+        '''
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.ready or not self.running, timeout):
+                raise TimeoutError("No frame within {timeout} s".format(timeout=timeout))
+            if not self.ready:
+                raise self.error or RuntimeError("Acquisition stopped")
+            frame, sequence, timestamp = self.ready.popleft()
+        return AcquiredFrame(self, frame, self.views[id(frame)], sequence, timestamp)
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.join()
+
+    def stats(self):
+        return {
+            "pool_size": self.pool_size,
+            "ready": len(self.ready),
+            "acquired": self.acquired,
+            "dropped": self.dropped,
+            "overflows": self.recovery.overflows,
+            "lost_frames": self.recovery.lost_frames,
+        }
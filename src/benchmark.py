@@ -0,0 +1,282 @@
+'''
+    Micro and end-to-end benchmarks of the acquisition pipeline.
+
+    Runs on any Linux box: the radar is replaced by radar_simulator.Device (unpaced, so the
+    pipeline runs as fast as it can). Results are written as JSON so runs can be compared
+    across commits and configurations.
+
+    The startup section measures cold starts in fresh interpreters: module import times and
+    import to first frame with the simulated device, checked against STARTUP_TARGET. None of
+    it may load the radar SDK library.
+
+    Usage: python src/benchmark.py [output.json] [frames]
+'''
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from threading import Thread
+import numpy as np
+import timestamps
+
+from radar import Radar, send_chirp, send_frame
+from radar_config import RadarMetrics
+from radar_protocol import HEADER_SIZE, ADC_SCALE, PayloadEncoder, unpack_header
+from radar_simulator import Device, Target
+from dsp import DigitalSignalProcessor
+from range_doppler import RangeDopplerProcessor
+from clutter import ClutterFilter, CLUTTER_METHODS
+
+MIN_TIME = 0.5 # [s] per micro benchmark
+E2E_FRAMES = 2000
+RADAR_CONFIG = dict(min_range=0.2, range_resolution=0.1, rx_antenna_number=7)
+STARTUP_RUNS = 3 # fresh interpreters per startup measurement, the fastest counts
+STARTUP_TARGET = 2.0 # [s] import to first frame, for a desktop class machine (scipy.signal dominates the import)
+
+# run in a fresh interpreter, prints the elapsed time and whether the SDK library got loaded
+STARTUP_SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+sdk = sys.modules.get("ifxRadarSDK")
+print(elapsed, sdk is not None and sdk._dll is not None)
+'''
+STARTUP_CODE = {
+    "import_radar_config": "import radar_config",
+    "import_ifxRadarSDK": "import ifxRadarSDK",
+    "import_radar": "import radar",
+    "first_frame": "\n".join((
+        "from radar import Radar",
+        "from radar_simulator import Device",
+        "Radar(stream_mode='frame', device=Device(paced=False), **{config!r}).next_frame_cube()",
+    )),
+}
+
+class NullSink:
+    '''
+        Socket stand-in that only counts bytes, isolates serialization cost
+    '''
+    def __init__(self):
+        self.bytes = 0
+
+    def sendall(self, data):
+        self.bytes += len(data)
+
+def measure(func, min_time=MIN_TIME):
+    '''
+        Calls func repeatedly for at least min_time seconds, returns timing statistics in us
+    '''
+    func()
+    durations = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_time:
+        t0 = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - t0)
+    durations = np.array(durations) * 1.0e6
+    return {
+        "iterations": len(durations),
+        "mean_us": float(durations.mean()),
+        "median_us": float(np.median(durations)),
+        "p99_us": float(np.percentile(durations, 99)),
+        "min_us": float(durations.min()),
+    }
+
+def legacy_json_chirp(chirp, client):
+    serialized_packet = json.dumps({ "packet_type": "chirp", "data": chirp.tolist() })
+    packet_len = str(len(serialized_packet)).zfill(4)
+    client.sendall(bytes(packet_len + serialized_packet, 'utf-8'))
+
+def micro_benchmarks():
+    results = {}
+    metrics = RadarMetrics(**RADAR_CONFIG)
+    results["radar_metrics_init"] = measure(lambda: RadarMetrics(**RADAR_CONFIG))
+    results["radar_metrics_config_dict"] = measure(lambda: metrics.config_dict)
+
+    device = Device(targets=[Target(1.2)], paced=False)
+    device.set_config(**metrics.config_dict)
+    frame = device.create_frame_from_device_handle()
+    device.get_next_frame(frame)
+    cube = frame.data.copy()
+    chirp = cube[0, 0].copy()
+
+    results["simulator_get_next_frame"] = measure(lambda: device.get_next_frame(frame))
+    results["sim_frame_get_mat_copy"] = measure(lambda: frame.get_mat_from_antenna(0))
+    results["sim_frame_get_mat_view"] = measure(lambda: frame.get_mat_from_antenna(0, copy=False))
+    results.update(sdk_frame_benchmarks(metrics, cube.shape))
+
+    sink = NullSink()
+    results["send_chirp"] = measure(lambda: send_chirp(chirp, sink))
+    results["send_frame"] = measure(lambda: send_frame(cube, sink))
+    results["legacy_json_chirp"] = measure(lambda: legacy_json_chirp(chirp, sink))
+    for encoding in ("int16", "int16_delta"):
+        encoder = PayloadEncoder(encoding, scale=ADC_SCALE)
+        results["send_frame_" + encoding] = measure(lambda: send_frame(cube, sink, encoder=encoder))
+        results["send_frame_" + encoding]["payload_bytes"] = len(encoder.encode(cube)[0])
+    results["send_frame"]["payload_bytes"] = cube.nbytes
+
+    dsp = DigitalSignalProcessor(metrics)
+    spectrum = np.empty(cube.shape[:-1] + (dsp.num_bins, ), dtype=np.complex64)
+    work = cube.copy()
+    results["dsp_decouple_dc_frame"] = measure(lambda: dsp.decouple_dc(cube, out=work))
+    results["dsp_filter_min_distance_frame"] = measure(lambda: dsp.filter_min_distance(work))
+    results["dsp_ss_fft_chirp"] = measure(lambda: dsp.ss_fft(chirp))
+    results["dsp_range_fft_frame"] = measure(lambda: dsp.range_fft(cube, out=spectrum))
+    # the filters work in place, every call gets a fresh copy of the spectrum (included in the time)
+    filtered = spectrum.copy()
+    for method in CLUTTER_METHODS:
+        clutter = ClutterFilter(metrics, method)
+        def filter_copy():
+            np.copyto(filtered, spectrum)
+            clutter.process(filtered)
+        results["clutter_" + method + "_frame"] = measure(filter_copy)
+
+    results["range_doppler_init"] = measure(lambda: RangeDopplerProcessor(metrics))
+    range_doppler = RangeDopplerProcessor(metrics, dsp=dsp)
+    rd_map = np.empty(range_doppler.map_shape, dtype=np.float32)
+    results["range_doppler_frame"] = measure(lambda: range_doppler.process(cube, out=rd_map))
+    return results
+
+def sdk_frame_benchmarks(metrics, shape):
+    '''
+        Frame.get_mat_from_antenna of the real SDK wrapper, skipped without libradar_sdk
+    '''
+    try:
+        import ifxRadarSDK
+        ifxRadarSDK.get_dll()
+    except (ImportError, OSError, RuntimeError):
+        return {}
+    frame = ifxRadarSDK.Frame(*shape)
+    return {
+        "sdk_frame_get_mat_copy": measure(lambda: frame.get_mat_from_antenna(0)),
+        "sdk_frame_get_mat_view": measure(lambda: frame.get_mat_from_antenna(0, copy=False)),
+    }
+
+def receive_packets(connection, num_packets, latencies):
+    '''
+        Socket sink: reads num_packets data packets after the config packet and records
+        the latency from frame acquisition (header timestamp) to reception
+    '''
+    config_length = int(connection.recv(4, socket.MSG_WAITALL))
+    connection.recv(config_length, socket.MSG_WAITALL)
+    header_buffer = bytearray(HEADER_SIZE)
+    payload_buffer = bytearray(1 << 20)
+    for _ in range(num_packets):
+        connection.recv_into(header_buffer, HEADER_SIZE, socket.MSG_WAITALL)
+        header = unpack_header(header_buffer)
+        view = memoryview(payload_buffer)[:header.payload_length]
+        while len(view):
+            view = view[connection.recv_into(view):]
+        latencies.append(timestamps.now() - header.timestamp)
+    connection.close()
+
+def end_to_end(stream_mode, num_frames, pipelined=False):
+    '''
+        Streams num_frames through Radar to a local TCP socket sink
+    '''
+    radar = Radar(stream_mode=stream_mode, device=Device(targets=[Target(1.2)], paced=False), **RADAR_CONFIG)
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    sender = socket.create_connection(listener.getsockname())
+    receiver, _ = listener.accept()
+    listener.close()
+
+    latencies = []
+    reader = Thread(target=receive_packets, args=(receiver, num_frames, latencies))
+    reader.start()
+    if pipelined:
+        radar.start_acquisition()
+
+    start = time.perf_counter()
+    radar.send_config_packet(sender)
+    streamer = Thread(target=stream_until_closed, args=(radar, sender), daemon=True)
+    streamer.start()
+    reader.join()
+    elapsed = time.perf_counter() - start
+    try:
+        sender.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass # the receiver closing with data in flight may have reset the connection already
+    streamer.join()
+    sender.close()
+    if pipelined:
+        radar.stop_acquisition()
+
+    latencies = np.array(latencies) * 1.0e6
+    return {
+        "stream_mode": stream_mode,
+        "pipelined": pipelined,
+        "frames": num_frames,
+        "frames_per_s": num_frames / elapsed,
+        "latency_mean_us": float(latencies.mean()),
+        "latency_median_us": float(np.median(latencies)),
+        "latency_p99_us": float(np.percentile(latencies, 99)),
+    }
+
+def cold_start(code):
+    '''
+        Returns (seconds, SDK library loaded) of code run in a fresh interpreter
+    '''
+    script = STARTUP_SCRIPT.format(code=code.format(config=RADAR_CONFIG))
+    output = subprocess.check_output([sys.executable, "-c", script], cwd=os.path.dirname(os.path.abspath(__file__)))
+    elapsed, sdk_loaded = output.decode().split()[-2:]
+    return float(elapsed), sdk_loaded == "True"
+
+def startup():
+    results = {}
+    sdk_loaded = False
+    for name, code in STARTUP_CODE.items():
+        runs = [cold_start(code) for _ in range(STARTUP_RUNS)]
+        results[name + "_s"] = min(elapsed for elapsed, _ in runs)
+        sdk_loaded = sdk_loaded or any(loaded for _, loaded in runs)
+    results["sdk_loaded"] = sdk_loaded
+    results["target_s"] = STARTUP_TARGET
+    results["within_target"] = results["first_frame_s"] <= STARTUP_TARGET and not sdk_loaded
+    return results
+
+def stream_until_closed(radar, client_socket):
+    try:
+        radar.start_stream(client_socket)
+    except OSError:
+        pass
+
+def environment():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "radar_config": RADAR_CONFIG,
+    }
+
+def run(num_frames=E2E_FRAMES):
+    return {
+        "environment": environment(),
+        "startup": startup(),
+        "micro": micro_benchmarks(),
+        "end_to_end": [
+            end_to_end("chirp", num_frames),
+            end_to_end("frame", num_frames),
+            end_to_end("frame", num_frames, pipelined=True),
+            end_to_end("range_doppler", num_frames),
+        ],
+    }
+
+if __name__ == "__main__":
+    num_frames = int(sys.argv[2]) if len(sys.argv) > 2 else E2E_FRAMES
+    results = json.dumps(run(num_frames), indent=2)
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "w") as f:
+            f.write(results)
+    print(results)
@@ -0,0 +1,83 @@
+'''
+    Camera capture thread that always holds only the newest frame.
+
+    cv2.VideoCapture.read() returns the oldest frame queued in the driver, so a consumer
+    that falls behind processes stale frames and timestamps them late. CameraCapture grabs
+    on its own thread and overwrites a single slot, the consumer waits for the next frame
+    newer than the one it processed last. Every frame carries its capture timestamp: the
+    driver buffer timestamp (CAP_PROP_POS_MSEC, V4L2 stamps buffers with the monotonic
+    clock) if the backend provides one, else timestamps.now() right after the grab.
+'''
+from threading import Condition, Thread
+import cv2
+import timestamps
+
+class CameraCapture(Thread):
+    def __init__(self, device=0, width=None, height=None, fps=None):
+        super().__init__(daemon=True)
+        self.cap = cv2.VideoCapture(device)
+        if width:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        if height:
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        if fps:
+            self.cap.set(cv2.CAP_PROP_FPS, fps)
+        # keep as few frames as possible queued in the driver
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+        self.condition = Condition()
+        self.frame = None
+        self.timestamp = None
+        self.index = 0
+        self.running = True
+        self.driver_timestamps = None
+
+    def run(self):
+        try:
+            while self.running:
+                if not self.cap.grab():
+                    break
+                timestamp = self.capture_timestamp()
+                ok, frame = self.cap.retrieve()
+                if not ok:
+                    break
+                with self.condition:
+                    self.frame = frame
+                    self.timestamp = timestamp
+                    self.index += 1
+                    self.condition.notify_all()
+        finally:
+            with self.condition:
+                self.running = False
+                self.condition.notify_all()
+
+    def capture_timestamp(self):
+        '''
+            Capture time on the timestamps.now() clock
+        '''
+        now = timestamps.now()
+        driver_ms = self.cap.get(cv2.CAP_PROP_POS_MSEC)
+        if self.driver_timestamps is None:
+            # the driver timestamp is usable if it is on the monotonic clock
+            self.driver_timestamps = driver_ms > 0 and abs(1.0e-3 * driver_ms - now) < 1.0
+        if self.driver_timestamps and driver_ms > 0:
+            return 1.0e-3 * driver_ms
+        return now
+
+    def read(self, last_index=0, timeout=None):
+        '''
+            Waits for a frame newer than last_index and returns (index, frame, timestamp).
+            Frames between last_index and index were dropped in favour of the newest one.
+            Returns None if the capture stopped.
+        '''
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.index > last_index or not self.running, timeout):
+                return None
+            if self.index <= last_index:
+                return None
+            return self.index, self.frame, self.timestamp
+
+    def release(self):
+        self.running = False
+        self.join(timeout=1.0)
+        self.cap.release()
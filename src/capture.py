@@ -0,0 +1,195 @@
+'''
+    Raw capture recording and replay.
+
+    A capture file is preallocated for max_frames frames and memory-mapped, so recording a
+    frame is a copy into the page cache and reading needs no deserialization. Layout:
+
+        preamble        magic (8s), number of recorded frames (Q), JSON header length (I)
+        JSON header     RadarMetrics parameters and config_dict, frame shape, dtype,
+                        max_frames and the offsets of the arrays below
+        sequences       int64 (max_frames, )
+        timestamps      float64 (max_frames, ) [s]
+        frames          float32 (max_frames, num_rx, num_chirps, num_samples)
+
+    Arrays start at page aligned offsets. The number of recorded frames is updated after
+    every frame, so a capture cut short by a crash is still readable. Radar stops the
+    capture once the file is full and goes on streaming.
+
+    CaptureReader exposes the recorded frames as read-only memory-mapped views for batch
+    reprocessing. ReplayDevice plays them back through the ifxRadarSDK.Device interface at
+    the recorded pace, a scaled speed or unthrottled.
+
+    Usage:
+        radar.start_capture("session.cap", max_frames=32*3600)
+        ...
+        replay = ReplayDevice("session.cap", speed=None)
+        radar = Radar(device=replay, **replay.metrics_parameters)
+'''
+import json
+import mmap
+import struct
+import time
+import numpy as np
+import timestamps
+from radar_simulator import Frame
+
+CAPTURE_MAGIC = b'RTVDCAP1'
+PREAMBLE_STRUCT = struct.Struct('<8sQI')
+ALIGNMENT = mmap.PAGESIZE
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+class CaptureWriter:
+    def __init__(self, path, metrics, frame_shape, max_frames, dtype=np.float32):
+        '''
+            frame_shape is (num_rx, num_chirps, num_samples) of the device frames
+        '''
+        self.path = path
+        self.max_frames = max_frames
+        self.frame_shape = tuple(frame_shape)
+        dtype = np.dtype(dtype)
+
+        header = {
+            "metrics": metrics.parameters,
+            "config": dict(metrics.config_dict),
+            "frame_shape": list(self.frame_shape),
+            "dtype": dtype.str,
+            "max_frames": max_frames,
+        }
+        # the offsets depend on the header length, which depends on the offsets
+        header["offsets"] = {"sequences": 0, "timestamps": 0, "frames": 0}
+        while True:
+            encoded = json.dumps(header).encode('utf-8')
+            sequences_offset = align(PREAMBLE_STRUCT.size + len(encoded))
+            timestamps_offset = align(sequences_offset + 8 * max_frames)
+            frames_offset = align(timestamps_offset + 8 * max_frames)
+            offsets = {"sequences": sequences_offset, "timestamps": timestamps_offset, "frames": frames_offset}
+            if offsets == header["offsets"]:
+                break
+            header["offsets"] = offsets
+        size = frames_offset + max_frames * int(np.prod(self.frame_shape)) * dtype.itemsize
+
+        with open(path, "wb") as f:
+            f.write(PREAMBLE_STRUCT.pack(CAPTURE_MAGIC, 0, len(encoded)))
+            f.write(encoded)
+            f.truncate(size)
+
+        self.preamble = np.memmap(path, dtype=np.uint8, mode="r+", shape=(PREAMBLE_STRUCT.size, ))
+        self.sequences = np.memmap(path, dtype=np.int64, mode="r+", offset=sequences_offset, shape=(max_frames, ))
+        self.timestamps = np.memmap(path, dtype=np.float64, mode="r+", offset=timestamps_offset, shape=(max_frames, ))
+        self.frames = np.memmap(path, dtype=dtype, mode="r+", offset=frames_offset, shape=(max_frames, ) + self.frame_shape)
+        self.num_frames = 0
+
+    def append(self, matrices, sequence, timestamp):
+        '''
+            matrices[rx] is the (num_chirps, num_samples) matrix of antenna rx, or a whole
+            frame cube
+        '''
+        if self.num_frames == self.max_frames:
+            raise IndexError("Capture file {path} is full".format(path=self.path))
+        frame = self.frames[self.num_frames]
+        for rx in range(self.frame_shape[0]):
+            frame[rx] = matrices[rx]
+        self.sequences[self.num_frames] = sequence
+        self.timestamps[self.num_frames] = timestamp
+        self.num_frames += 1
+        struct.pack_into('<Q', self.preamble, 8, self.num_frames)
+
+    def flush(self):
+        for array in (self.frames, self.sequences, self.timestamps, self.preamble):
+            array.flush()
+
+    def close(self):
+        self.flush()
+        del self.frames, self.sequences, self.timestamps, self.preamble
+
+class CaptureReader:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            magic, num_frames, header_length = PREAMBLE_STRUCT.unpack(f.read(PREAMBLE_STRUCT.size))
+            if magic != CAPTURE_MAGIC:
+                raise ValueError("{path} is not a capture file".format(path=path))
+            self.header = json.loads(f.read(header_length).decode('utf-8'))
+
+        offsets = self.header["offsets"]
+        max_frames = self.header["max_frames"]
+        self.path = path
+        self.num_frames = num_frames
+        self.frame_shape = tuple(self.header["frame_shape"])
+        self.metrics_parameters = self.header["metrics"]
+        self.config = self.header["config"]
+        self.sequences = np.memmap(path, dtype=np.int64, mode="r", offset=offsets["sequences"], shape=(max_frames, ))[:num_frames]
+        self.timestamps = np.memmap(path, dtype=np.float64, mode="r", offset=offsets["timestamps"], shape=(max_frames, ))[:num_frames]
+        self.frames = np.memmap(
+            path,
+            dtype=np.dtype(self.header["dtype"]),
+            mode="r",
+            offset=offsets["frames"],
+            shape=(max_frames, ) + self.frame_shape
+        )[:num_frames]
+
+    def __len__(self):
+        return self.num_frames
+
+    def __iter__(self):
+        '''
+            Yields (sequence, timestamp, frame) with frame as a zero-copy view on the file
+        '''
+        for i in range(self.num_frames):
+            yield int(self.sequences[i]), float(self.timestamps[i]), self.frames[i]
+
+class ReplayDevice():
+    def __init__(self, path, speed=1.0, loop=False):
+        '''
+            Plays a capture back with the ifxRadarSDK.Device interface.
+
+            speed       1.0 replays at the recorded pace, 2.0 twice as fast and so on,
+                        None replays as fast as possible
+            loop        start over at the end of the capture, else get_next_frame raises
+                        EOFError
+        '''
+        self.capture = CaptureReader(path)
+        if not len(self.capture):
+            raise ValueError("{path} contains no frames".format(path=path))
+        self.speed = speed
+        self.loop = loop
+        self.metrics_parameters = self.capture.metrics_parameters
+        self.index = 0
+        self.start_time = None
+
+    def set_config(self, **config):
+        '''
+            Only the recorded configuration can be replayed
+        '''
+        mismatch = {key: value for key, value in config.items() if self.capture.config.get(key) != value}
+        if mismatch:
+            raise ValueError("Configuration differs from the capture: {mismatch}".format(mismatch=mismatch))
+        self.index = 0
+        self.start_time = None
+
+    def create_frame_from_device_handle(self):
+        return Frame(*self.capture.frame_shape)
+
+    def get_shield_uuid(self):
+        return None
+
+    def get_next_frame(self, frame):
+        if self.index == len(self.capture):
+            if not self.loop:
+                raise EOFError("End of capture {path}".format(path=self.capture.path))
+            self.index = 0
+            self.start_time = None
+
+        recorded = self.capture.timestamps
+        if self.speed:
+            now = timestamps.now()
+            if self.start_time is None:
+                self.start_time = now - (recorded[self.index] - recorded[0]) / self.speed
+            delay = self.start_time + (recorded[self.index] - recorded[0]) / self.speed - now
+            if delay > 0:
+                time.sleep(delay)
+
+        # like the SDK, the frame is copied into the frame memory the consumer's views point to
+        np.copyto(frame.data, self.capture.frames[self.index])
+        self.index += 1
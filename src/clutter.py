@@ -0,0 +1,87 @@
+'''
+    Slow-time clutter removal.
+
+    Static reflectors (treadmill frame, handrails, walls) add a constant complex value to
+    their range bins in every chirp. ClutterFilter removes it from range spectra along slow
+    time (the chirps), with its state carried from one frame to the next so a frame is
+    filtered as the continuation of the previous one. Every method is vectorized over
+    antennas and range bins and works in place:
+
+        "background"    subtracts an exponential moving average of the spectrum of every
+                        antenna and range bin, updated once per frame with the frame mean
+        "mti"           moving target indication: the difference of consecutive chirps, the
+                        first chirp of a frame is differenced with the last one of the
+                        previous frame
+        "iir"           Butterworth high-pass along slow time with persistent filter state
+
+    Input is the complex output of DigitalSignalProcessor.range_fft, (rx, chirps, bins) or
+    (chirps, bins). The state is reset when the shape changes.
+'''
+from scipy import signal
+import numpy as np
+from dsp_plan import butter_sos
+
+CLUTTER_METHODS = ("background", "mti", "iir")
+
+class ClutterFilter:
+    def __init__(self, radar_metrics, method="background", time_constant=5.0, cutoff=0.05, order=2):
+        '''
+            time_constant [s] of the background average. cutoff [Hz] and order of the iir
+            high-pass, the default cutoff keeps breathing motion. The iir filter treats the
+            chirps as evenly spaced at the mean chirp rate (num_chirps_per_frame *
+            frame_rate), although they come in bursts.
+        '''
+        if method not in CLUTTER_METHODS:
+            raise ValueError("Unknown clutter removal method: {method}".format(method=method))
+        self.method = method
+        self.alpha = 1.0 - np.exp(-1.0 / (time_constant * radar_metrics.frame_rate))
+        chirp_rate = radar_metrics.num_chirps_per_frame * radar_metrics.frame_rate
+        self.sos = butter_sos(order, cutoff, 'hp', chirp_rate)
+        self.state = None
+        self.shape = None
+
+    def reset(self):
+        self.state = None
+
+    def process(self, spectrum):
+        '''
+            Removes the clutter from spectrum in place and returns it
+        '''
+        if spectrum.shape != self.shape:
+            self.shape = spectrum.shape
+            self.state = None
+        if self.method == "background":
+            return self.subtract_background(spectrum)
+        if self.method == "mti":
+            return self.mti(spectrum)
+        return self.high_pass(spectrum)
+
+    def subtract_background(self, spectrum):
+        frame_mean = spectrum.mean(axis=-2, keepdims=True)
+        if self.state is None:
+            self.state = frame_mean
+        else:
+            self.state += self.alpha * (frame_mean - self.state)
+        spectrum -= self.state
+        return spectrum
+
+    def mti(self, spectrum):
+        last_chirp = spectrum[..., -1:, :].copy()
+        # numpy buffers overlapping operands, so this differences the original chirps
+        spectrum[..., 1:, :] -= spectrum[..., :-1, :]
+        if self.state is None:
+            spectrum[..., :1, :] = 0
+        else:
+            spectrum[..., :1, :] -= self.state
+        self.state = last_chirp
+        return spectrum
+
+    def high_pass(self, spectrum):
+        if self.state is None:
+            # start in steady state for the first chirp, so the clutter does not ring in
+            zi = signal.sosfilt_zi(self.sos)
+            zi = zi.reshape(zi.shape[:1] + (1, ) * (spectrum.ndim - 2) + (2, 1))
+            self.state = zi * spectrum[..., :1, :]
+        filtered, self.state = signal.sosfilt(self.sos, spectrum, axis=-2, zi=self.state)
+        spectrum[...] = filtered
+        return spectrum
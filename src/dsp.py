@@ -0,0 +1,114 @@
+'''
+    Whole-frame digital signal processing.
+
+    All methods work along the last (fast time / sample) axis, so they take a single chirp,
+    a (chirps, samples) matrix or a full (rx, chirps, samples) frame cube and process every
+    chirp in one batched call. Data stays float32 / complex64.
+'''
+from scipy.fft import rfft, next_fast_len
+from scipy import signal
+import numpy as np
+from dsp_plan import range_plan, window_array, highpass_sos
+from radar_tools import C
+
+class DigitalSignalProcessor:
+    def __init__(self, radar_metrics, window="hann", filter_order=8, zero_pad=0):
+        '''
+            zero_pad is the minimum FFT size, the actual size is the next fast FFT length
+            of max(zero_pad, num_samples_per_chirp)
+        '''
+        self.radar_metrics = radar_metrics
+        # shared with every processor of the same configuration (see dsp_plan)
+        self.plan = range_plan(radar_metrics, window, filter_order, zero_pad)
+        self.num_samples = self.plan.num_samples
+        self.fft_size = self.plan.fft_size
+        self.num_bins = self.plan.num_bins
+        self.window = self.plan.window
+        self.filter_order = filter_order
+        self.min_range_cutoff = self.plan.min_range_cutoff
+        self.work = None
+
+    def butterworth_sos(self, cutoff, order=8):
+        '''
+            The high-pass is designed once per (cutoff, order, sample rate) and reused
+        '''
+        return highpass_sos(cutoff, order, self.radar_metrics.adc_sample_rate_hz)
+
+    def hp_filter_butterworth(self, sig, cutoff, order=8):
+        # the coefficients are float64, the data stays float32
+        return signal.sosfilt(self.butterworth_sos(cutoff, order), sig, axis=-1).astype(np.float32, copy=False)
+
+    def decouple_dc(self, sig, out=None):
+        '''
+            Removes the mean of every chirp. In place unless out is given.
+        '''
+        if out is None:
+            out = sig
+        return np.subtract(sig, sig.mean(axis=-1, keepdims=True, dtype=np.float32), out=out)
+
+    def ss_fft(self, sig, zero_pad=0, out=None, window=True):
+        '''
+            Single sided FFT of every chirp in sig.
+            Returns (spectrum, frequency axis, number of bins)
+
+            Unlike old/dsp.py the chirps are Hann windowed (the processor's window for
+            num_samples long chirps), which lowers the sidelobes but widens the peaks and
+            scales the amplitudes by the window mean. window=False gives the unwindowed FFT.
+        '''
+        n = next_fast_len(max(zero_pad, sig.shape[-1]), real=True)
+        if window:
+            sig = np.multiply(sig, self.window_for(sig.shape[-1]), dtype=np.float32)
+        spectrum = rfft(sig, n=n, axis=-1)[..., :n // 2]
+        if out is not None:
+            out[...] = spectrum
+            spectrum = out
+
+        fs = self.radar_metrics.adc_sample_rate_hz
+        x_f = np.arange(n // 2) * (fs / n)
+        return spectrum, x_f, n // 2
+
+    def window_for(self, num_samples):
+        if num_samples == self.num_samples:
+            return self.window
+        return window_array("hann", num_samples)
+
+    def if_to_d(self, if_sig):
+        S = self.radar_metrics.chirp_slope
+        return C * if_sig / (2.0 * S)
+
+    def d_to_if(self, dis):
+        S = self.radar_metrics.chirp_slope
+        return S * 2.0 * dis / C
+
+    def filter_min_distance(self, sig):
+        '''
+            High-pass below the IF of min_range, in place
+        '''
+        if self.plan.highpass_sos is None:
+            return sig
+        # sosfilt has no output argument, its result is copied back so callers keep their buffer
+        sig[...] = signal.sosfilt(self.plan.highpass_sos, sig, axis=-1)
+        return sig
+
+    def range_fft(self, frame, out=None):
+        '''
+            DC removal, min range high-pass and windowed real FFT of every chirp of frame.
+            Returns the complex64 range spectrum with shape frame.shape[:-1] + (num_bins, ),
+            written into out if given.
+        '''
+        if self.work is None or self.work.shape != frame.shape:
+            self.work = np.empty(frame.shape, dtype=np.float32)
+        work = self.decouple_dc(frame, out=self.work)
+        work = self.filter_min_distance(work)
+        np.multiply(work, self.window, out=work)
+        spectrum = rfft(work, n=self.fft_size, axis=-1, overwrite_x=True)[..., :self.num_bins]
+        if out is None:
+            return spectrum
+        out[...] = spectrum
+        return out
+
+    def range_axis(self):
+        '''
+            Distance [m] of every range bin returned by range_fft (read-only)
+        '''
+        return self.plan.range_axis
@@ -0,0 +1,103 @@
+'''
+    Per-configuration DSP data, computed once and cached.
+
+    Window arrays, filter coefficients, FFT sizes, range / velocity axes and the crop slices
+    only depend on the (immutable, hashable) RadarMetrics and a few processing options, so
+    they are built once per configuration and shared by every processor using it. The caches
+    are LRU bounded: switching back and forth between a few configurations costs nothing
+    after their first use.
+
+    Cached arrays are shared, so they are read-only (except the filter coefficients, which
+    scipy needs writeable).
+'''
+from functools import lru_cache
+from scipy.fft import fftfreq, fftshift, next_fast_len
+from scipy import signal
+import numpy as np
+from radar_tools import C
+
+PLAN_CACHE_SIZE = 8
+
+def read_only(array):
+    array.flags.writeable = False
+    return array
+
+@lru_cache(maxsize=4 * PLAN_CACHE_SIZE)
+def window_array(window, length):
+    '''
+        window is anything scipy.signal.get_window accepts that is hashable, e.g. "hann" or
+        ("kaiser", 8.0)
+    '''
+    return read_only(signal.get_window(window, length).astype(np.float32))
+
+@lru_cache(maxsize=4 * PLAN_CACHE_SIZE)
+def butter_sos(order, cutoff, btype, sample_rate):
+    '''
+        Butterworth second-order sections in float64, which very low cutoffs relative to
+        the sample rate need. cutoff is a frequency [Hz] or a (low, high) tuple for band
+        filters. Left writeable like highpass_sos, do not modify.
+    '''
+    return signal.butter(order, cutoff, btype, fs=sample_rate, output='sos')
+
+@lru_cache(maxsize=4 * PLAN_CACHE_SIZE)
+def highpass_sos(cutoff, order, sample_rate):
+    # float64 like butter_sos, the cutoff can be low relative to the sample rate. Left
+    # writeable, scipy.signal.sosfilt rejects read-only coefficients. Do not modify.
+    return signal.butter(order, cutoff, 'hp', fs=sample_rate, output='sos')
+
+class RangePlan:
+    '''
+        Range FFT data of DigitalSignalProcessor
+    '''
+    def __init__(self, radar_metrics, window="hann", filter_order=8, zero_pad=0):
+        self.num_samples = radar_metrics.num_samples_per_chirp
+        self.fft_size = next_fast_len(max(zero_pad, self.num_samples), real=True)
+        self.num_bins = self.fft_size // 2
+        self.window = window_array(window, self.num_samples)
+
+        sample_rate = radar_metrics.adc_sample_rate_hz
+        # IF frequency of a target at distance d is 2 * S * d / C
+        self.if_to_distance = C / (2.0 * radar_metrics.chirp_slope)
+        self.min_range_cutoff = radar_metrics.min_range / self.if_to_distance
+        self.highpass_sos = None
+        if self.min_range_cutoff > 0:
+            self.highpass_sos = highpass_sos(self.min_range_cutoff, filter_order, sample_rate)
+
+        self.range_axis = read_only(self.if_to_distance * np.arange(self.num_bins) * (sample_rate / self.fft_size))
+        range_bins = np.flatnonzero(
+            (self.range_axis >= radar_metrics.min_range) & (self.range_axis <= radar_metrics.max_range)
+        )
+        # the mask selects a contiguous block, slicing keeps the crop a view
+        self.range_slice = slice(range_bins[0], range_bins[-1] + 1) if len(range_bins) else slice(0, 0)
+
+class DopplerPlan:
+    '''
+        Slow time FFT data of RangeDopplerProcessor
+    '''
+    def __init__(self, radar_metrics, doppler_window="hann"):
+        self.num_chirps = radar_metrics.num_chirps_per_frame
+        self.doppler_window = window_array(doppler_window, self.num_chirps)[:, None]
+
+        wavelength = C / radar_metrics.center_frequency
+        chirp_time = 1.0e-10 * radar_metrics.chirp_to_chirp_time_100ps
+        doppler_frequencies = fftshift(fftfreq(self.num_chirps, d=chirp_time))
+        self.velocity_axis = read_only(doppler_frequencies * wavelength / 2.0)
+        velocity_bins = np.flatnonzero(np.abs(self.velocity_axis) <= radar_metrics.max_speed * (1.0 + 1e-6))
+        self.velocity_slice = slice(velocity_bins[0], velocity_bins[-1] + 1)
+
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
+def range_plan(radar_metrics, window="hann", filter_order=8, zero_pad=0):
+    return RangePlan(radar_metrics, window, filter_order, zero_pad)
+
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
+def doppler_plan(radar_metrics, doppler_window="hann"):
+    return DopplerPlan(radar_metrics, doppler_window)
+
+def cache_info():
+    return {
+        "range_plan": range_plan.cache_info()._asdict(),
+        "doppler_plan": doppler_plan.cache_info()._asdict(),
+        "window_array": window_array.cache_info()._asdict(),
+        "highpass_sos": highpass_sos.cache_info()._asdict(),
+        "butter_sos": butter_sos.cache_info()._asdict(),
+    }
@@ -0,0 +1,132 @@
+'''
+    Bounded single-producer/single-consumer ring buffer of preallocated frame slots.
+
+    The acquisition loop copies each frame into a free slot with push() and never allocates
+    or touches the network. A consumer (e.g. FrameSender) takes the oldest filled slot with
+    pop() and hands it back with release() once sent, which is when the slot can be reused.
+    When no slot is free, push() blocks, overwrites the oldest filled slot or drops the new
+    frame depending on the overflow policy.
+'''
+from collections import deque
+from threading import Condition, Thread
+import numpy as np
+
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+class FrameRingBuffer:
+    def __init__(self, slots, shape, dtype=np.float32, policy=DROP_OLDEST):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy: {policy}".format(policy=policy))
+        if slots < 2:
+            raise ValueError("A ring buffer needs at least 2 slots")
+        self.data = np.empty((slots, ) + tuple(shape), dtype=dtype)
+        self.sequences = np.zeros(slots, dtype=np.int64)
+        self.timestamps = np.zeros(slots, dtype=np.float64)
+        self.slots = slots
+        self.policy = policy
+
+        # slot indices in fill order and slots that can be written
+        self.filled = deque(maxlen=slots)
+        self.free = deque(range(slots), maxlen=slots)
+        self.closed = False
+        self.pushed = 0
+        self.dropped_oldest = 0
+        self.dropped_newest = 0
+        self.condition = Condition()
+
+    @property
+    def dropped(self):
+        return self.dropped_oldest + self.dropped_newest
+
+    def __len__(self):
+        return len(self.filled)
+
+    def push(self, frame, sequence=0, timestamp=0.0):
+        '''
+            Copies frame into a free slot. Returns False if the frame was dropped.
+        '''
+        with self.condition:
+            while not self.free:
+                if self.closed or self.policy == DROP_NEWEST:
+                    self.dropped_newest += 1
+                    return False
+                if self.policy == DROP_OLDEST and self.filled:
+                    self.free.append(self.filled.popleft())
+                    self.dropped_oldest += 1
+                    break
+                self.condition.wait()
+
+            slot = self.free.popleft()
+
+        # the slot is owned by the producer until it is appended to filled
+        self.data[slot] = frame
+        self.sequences[slot] = sequence
+        self.timestamps[slot] = timestamp
+        with self.condition:
+            self.filled.append(slot)
+            self.pushed += 1
+            self.condition.notify_all()
+        return True
+
+    def pop(self, timeout=None):
+        '''
+            Returns (slot, frame, sequence, timestamp) of the oldest filled slot, or None on
+            timeout or once the buffer is closed and empty. frame is a view on the slot and
+            stays valid until release(slot) is called.
+        '''
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.filled or self.closed, timeout):
+                return None
+            if not self.filled:
+                return None
+            slot = self.filled.popleft()
+            return slot, self.data[slot], int(self.sequences[slot]), float(self.timestamps[slot])
+
+    def release(self, slot):
+        with self.condition:
+            self.free.append(slot)
+            self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def stats(self):
+        return {
+            "slots": self.slots,
+            "depth": len(self.filled),
+            "pushed": self.pushed,
+            "dropped_oldest": self.dropped_oldest,
+            "dropped_newest": self.dropped_newest,
+        }
+
+class FrameSender(Thread):
+    '''
+        Long-lived thread that sends the frames of a FrameRingBuffer in order, so only one
+        thread ever writes to the socket.
+    '''
+    def __init__(self, ring_buffer, send_func, client):
+        super().__init__(daemon=True)
+        self.ring_buffer = ring_buffer
+        self.send_func = send_func
+        self.client = client
+        self.error = None
+
+    def run(self):
+        try:
+            while True:
+                item = self.ring_buffer.pop()
+                if item is None:
+                    return
+                slot, frame, sequence, timestamp = item
+                try:
+                    self.send_func(frame, self.client, sequence, timestamp)
+                finally:
+                    self.ring_buffer.release(slot)
+        except Exception as e:
+            self.error = e
+            self.ring_buffer.close()
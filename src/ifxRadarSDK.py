@@ -4,10 +4,14 @@ The package expects the library (radar_sdk.dll on Windows, libradar_sdk.so on
 Linux) either in the same directory as this file (ifxRadarSDK.py) or in a
 subdirectory ../../libs/ARCH/ relative to this file where ARCH is depending on
 the platform either win32_x86, win32_x64, raspi, or linux_x64.
+
+The library is loaded on first use (get_dll), not at import time, so this
+module can be imported on machines without it. The first call that needs the
+SDK raises RuntimeError or OSError if it cannot be loaded.
 """
 
 from ctypes import *
-import platform
+from threading import Lock
 import platform, os, sys
 import numpy as np
 
@@ -15,16 +19,17 @@ import numpy as np
 #   from ifxRadarSDK import *
 # would import all objects, including the ones from ctypes. To avoid name space
 # pollution, we list what symbols should be exported.
-__all__ = ["sdk_version", "sdk_min_version", "error_get", "error_clear", "Frame", "Device", "RadarSDKError"]
+__all__ = ["sdk_version", "sdk_min_version", "get_dll", "error_get", "error_clear", "get_port_list", "get_device_list", "Frame", "Device", "RadarSDKError"]
 
-# version of sdk, will be initialized in initialize_module()
+# version of sdk, will be initialized when the library is loaded
 sdk_version = None
 
 # minimum version of SDK required
 sdk_min_version = "1.1.1"
 
-# mapping of error code to the respective exception
-error_mapping = {}
+# ctypes handle of the library, loaded by get_dll()
+_dll = None
+_dll_lock = Lock()
 
 def check_version(version):
     """Check that version is at least py_sdk_min_ver"""
@@ -117,10 +122,12 @@ def initialize_module():
     dll.ifx_radar_sdk_get_version_string.restype = c_char_p
     dll.ifx_radar_sdk_get_version_string.argtypes = None
 
-    sdk_version = dll.ifx_radar_sdk_get_version_string().decode("ascii")
-    if not check_version(sdk_version):
+    global sdk_version
+    version = dll.ifx_radar_sdk_get_version_string().decode("ascii")
+    if not check_version(version):
         # exception about non matching dll
-        raise RuntimeError("radar SDK is version %s, but required at least %s" % (sdk_version, sdk_min_version))
+        raise RuntimeError("radar SDK is version %s, but required at least %s" % (version, sdk_min_version))
+    sdk_version = version
 
     # error
     dll.ifx_error_to_string.restype = c_char_p
@@ -139,6 +146,15 @@ def initialize_module():
     dll.ifx_device_create_by_uuid.restype = c_void_p
     dll.ifx_device_create_by_uuid.argtypes = [POINTER(c_uint8)]
 
+    # serial port access, not exported by every SDK build (see optional_function)
+    if hasattr(dll, "ifx_device_create_by_port"):
+        dll.ifx_device_create_by_port.restype = c_void_p
+        dll.ifx_device_create_by_port.argtypes = [c_char_p]
+
+    if hasattr(dll, "com_get_port_list"):
+        dll.com_get_port_list.restype = c_int
+        dll.com_get_port_list.argtypes = [c_char_p, c_size_t]
+
     dll.ifx_device_get_shield_uuid.restype = c_bool
     dll.ifx_device_get_shield_uuid.argtypes = [c_void_p, POINTER(c_uint8)]
 
@@ -164,84 +180,179 @@ def initialize_module():
     dll.ifx_frame_get_mat_from_antenna_r.restype = MatrixRStructPointer
     dll.ifx_frame_get_mat_from_antenna_r.argtypes = [FrameStructPointer, c_uint8]
 
-    error_api_base = 0x00010000
-    error_dev_base = 0x00011000
-    error_app_base = 0x00020000
-
-    # list of all
-    errors = {
-        error_api_base+0x01: "RadarSDKArgumentNullError",
-        error_api_base+0x02: "RadarSDKArgumentInvalidError",
-        error_api_base+0x03: "RadarSDKArgumentOutOfBoundsError",
-        error_api_base+0x04: "RadarSDKArgumentInvalidExpectedRealError",
-        error_api_base+0x05: "RadarSDKArgumentInvalidExpectedComplexError",
-        error_api_base+0x06: "RadarSDKIndexOutOfBoundsError",
-        error_api_base+0x07: "RadarSDKDimensionMismatchError",
-        error_api_base+0x08: "RadarSDKMemoryAllocationFailedError",
-        error_api_base+0x09: "RadarSDKInplaceCalculationNotSupportedError",
-        error_api_base+0x0A: "RadarSDKMatrixSingularError",
-        error_api_base+0x0B: "RadarSDKMatrixNotPositiveDefinitieError",
-        error_api_base+0x0C: "RadarSDKNotSupportedError",
-        # device related errors
-        error_dev_base+0x00: "RadarSDKNoDeviceError",
-        error_dev_base+0x01: "RadarSDKDeviceBusyError",
-        error_dev_base+0x02: "RadarSDKCommunicationError",
-        error_dev_base+0x03: "RadarSDKNumSamplesOutOfRangeError",
-        error_dev_base+0x04: "RadarSDKRxAntennaCombinationNotAllowedError",
-        error_dev_base+0x05: "RadarSDKIfGainOutOfRangeError",
-        error_dev_base+0x06: "RadarSDKSamplerateOutOfRangeError",
-        error_dev_base+0x07: "RadarSDKRfOutOfRangeError",
-        error_dev_base+0x08: "RadarSDKTxPowerOutOfRangeError",
-        error_dev_base+0x09: "RadarSDKChirpRateOutOfRangeError",
-        error_dev_base+0x0a: "RadarSDKFrameRateOutOfRangeError",
-        error_dev_base+0x0b: "RadarSDKNumChirpsNotAllowedError",
-        error_dev_base+0x0C: "RadarSDKFrameSizeNotSupportedError",
-        error_dev_base+0x0D: "RadarSDKTimeoutError",
-        error_dev_base+0x0E: "RadarSDKFifoOverflowError",
-        error_dev_base+0x0F: "RadarSDKTxAntennaModeNotAllowedError"
-    }
-
-    for errcode, name in errors.items():
-        descr = dll.ifx_error_to_string(errcode).decode("ascii")
-
-        # dynamically generate the class in the modules global scope
-        pycode = """
-global %s
-class %s(RadarSDKError):
-    '''%s'''
-    def __init__(self):
-        super().__init__(%d)
-        """ % (name,name,descr,errcode)
-        exec(pycode)
-
-        # export the error class
-        __all__.append(name)
-
-        # add the class to the list of exceptions
-        error_mapping[errcode] = eval(name)
-
     return dll
 
+def get_dll():
+    """Return the ctypes handle of the SDK, loading it on the first call"""
+    global _dll
+    if _dll is None:
+        with _dll_lock:
+            if _dll is None:
+                _dll = initialize_module()
+    return _dll
+
+def __getattr__(name):
+    """Module attribute dll, for code using ifxRadarSDK.dll directly"""
+    if name == "dll":
+        return get_dll()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+def optional_function(name):
+    """SDK function name, RuntimeError if the installed SDK does not export it"""
+    dll = get_dll()
+    if not hasattr(dll, name):
+        raise RuntimeError("radar SDK %s does not export %s" % (sdk_version, name))
+    return getattr(dll, name)
+
+def error_to_string(error):
+    """Description of an SDK error code"""
+    try:
+        return get_dll().ifx_error_to_string(error).decode("ascii")
+    except (OSError, RuntimeError):
+        return "radar SDK error 0x%x" % error
+
 class RadarSDKError(Exception):
-    def __init__(self, error):
+    # error code of the subclasses
+    code = None
+
+    def __init__(self, error=None):
         """Create new RadarSDKException with error code given by error"""
+        if error is None:
+            error = self.code
         self.error = error
-        self.message = dll.ifx_error_to_string(error).decode("ascii")
+        self.message = error_to_string(error)
 
     def __str__(self):
         """Exception message"""
         return self.message
 
-dll = initialize_module()
+error_api_base = 0x00010000
+error_dev_base = 0x00011000
+error_app_base = 0x00020000
+
+class RadarSDKArgumentNullError(RadarSDKError):
+    code = error_api_base+0x01
+
+class RadarSDKArgumentInvalidError(RadarSDKError):
+    code = error_api_base+0x02
+
+class RadarSDKArgumentOutOfBoundsError(RadarSDKError):
+    code = error_api_base+0x03
+
+class RadarSDKArgumentInvalidExpectedRealError(RadarSDKError):
+    code = error_api_base+0x04
+
+class RadarSDKArgumentInvalidExpectedComplexError(RadarSDKError):
+    code = error_api_base+0x05
+
+class RadarSDKIndexOutOfBoundsError(RadarSDKError):
+    code = error_api_base+0x06
+
+class RadarSDKDimensionMismatchError(RadarSDKError):
+    code = error_api_base+0x07
+
+class RadarSDKMemoryAllocationFailedError(RadarSDKError):
+    code = error_api_base+0x08
+
+class RadarSDKInplaceCalculationNotSupportedError(RadarSDKError):
+    code = error_api_base+0x09
+
+class RadarSDKMatrixSingularError(RadarSDKError):
+    code = error_api_base+0x0A
+
+class RadarSDKMatrixNotPositiveDefinitieError(RadarSDKError):
+    code = error_api_base+0x0B
+
+class RadarSDKNotSupportedError(RadarSDKError):
+    code = error_api_base+0x0C
+
+# device related errors
+class RadarSDKNoDeviceError(RadarSDKError):
+    code = error_dev_base+0x00
+
+class RadarSDKDeviceBusyError(RadarSDKError):
+    code = error_dev_base+0x01
+
+class RadarSDKCommunicationError(RadarSDKError):
+    code = error_dev_base+0x02
+
+class RadarSDKNumSamplesOutOfRangeError(RadarSDKError):
+    code = error_dev_base+0x03
+
+class RadarSDKRxAntennaCombinationNotAllowedError(RadarSDKError):
+    code = error_dev_base+0x04
+
+class RadarSDKIfGainOutOfRangeError(RadarSDKError):
+    code = error_dev_base+0x05
+
+class RadarSDKSamplerateOutOfRangeError(RadarSDKError):
+    code = error_dev_base+0x06
+
+class RadarSDKRfOutOfRangeError(RadarSDKError):
+    code = error_dev_base+0x07
+
+class RadarSDKTxPowerOutOfRangeError(RadarSDKError):
+    code = error_dev_base+0x08
+
+class RadarSDKChirpRateOutOfRangeError(RadarSDKError):
+    code = error_dev_base+0x09
+
+class RadarSDKFrameRateOutOfRangeError(RadarSDKError):
+    code = error_dev_base+0x0a
+
+class RadarSDKNumChirpsNotAllowedError(RadarSDKError):
+    code = error_dev_base+0x0b
+
+class RadarSDKFrameSizeNotSupportedError(RadarSDKError):
+    code = error_dev_base+0x0C
+
+class RadarSDKTimeoutError(RadarSDKError):
+    code = error_dev_base+0x0D
+
+class RadarSDKFifoOverflowError(RadarSDKError):
+    code = error_dev_base+0x0E
+
+class RadarSDKTxAntennaModeNotAllowedError(RadarSDKError):
+    code = error_dev_base+0x0F
+
+# mapping of error code to the respective exception
+error_mapping = {error.code: error for error in RadarSDKError.__subclasses__()}
+
+# export the error classes
+__all__.extend(error.__name__ for error in error_mapping.values())
 
 
 def error_get():
     """Get last SDK error"""
-    return dll.ifx_error_get()
+    return get_dll().ifx_error_get()
 
 def error_clear():
     """Clear SDK error"""
-    dll.ifx_error_clear()
+    get_dll().ifx_error_clear()
+
+def get_port_list():
+    """Return the names of the serial ports radar boards are attached to"""
+    buffer = create_string_buffer(4096)
+    if optional_function("com_get_port_list")(buffer, sizeof(buffer)) <= 0:
+        return []
+    return [port for port in buffer.value.decode("ascii").split(";") if port]
+
+def get_device_list():
+    """Return (port, shield uuid) of all attached radar devices
+
+    Every port is opened briefly to read the shield uuid, so devices already
+    opened by another process are skipped. uuid is None for shields without
+    a unique id.
+    """
+    devices = []
+    for port in get_port_list():
+        try:
+            device = Device(port=port)
+        except RadarSDKError:
+            continue
+        devices.append((port, device.get_shield_uuid()))
+        del device
+    return devices
 
 
 
@@ -249,7 +360,7 @@ def error_clear():
 def check_rc(error_code=None):
     """Raise an exception if error_code is not IFX_OK (0)"""
     if error_code == None:
-        error_code = dll.ifx_error_get()
+        error_code = get_dll().ifx_error_get()
         error_clear()
     if error_code:
         if error_code in error_mapping:
@@ -274,7 +385,7 @@ class Frame():
             num_chirps_per_frame    Number of chirps configured in a frame
             num_samples_per_chirp   Number of chirps configured in a frame
         """
-        self.handle = dll.ifx_frame_create_r(num_antennas, num_chirps_per_frame, num_samples_per_chirp)
+        self.handle = get_dll().ifx_frame_create_r(num_antennas, num_chirps_per_frame, num_samples_per_chirp)
         check_rc()
 
     @classmethod
@@ -287,7 +398,7 @@ class Frame():
     def __del__(self):
         """Destroy frame handle"""
         if hasattr(self, "handle"):
-            dll.ifx_frame_destroy_r(self.handle)
+            get_dll().ifx_frame_destroy_r(self.handle)
 
     def get_num_rx(self):
         """Return the number of virtual active Rx antennas in the radar device"""
@@ -307,14 +418,14 @@ class Frame():
         # we don't have to free mat because the matrix is saved in the frame
         # handle.
         # matrices are in C order (row major order)
-        mat = dll.ifx_frame_get_mat_from_antenna_r(self.handle, antenna)
+        mat = get_dll().ifx_frame_get_mat_from_antenna_r(self.handle, antenna)
         d = mat.contents.d
         shape = (mat.contents.rows, mat.contents.cols)
         return np.array(np.ctypeslib.as_array(d, shape), order="C", copy=copy)
 
 
 class Device():
-    def __init__(self, uuid=None):
+    def __init__(self, uuid=None, port=None):
         """Create new device
 
         Search for a Infineon radar sensor device connected to the host machine
@@ -337,9 +448,13 @@ class Device():
                         uuid:
                             0123456789abcdef0123456789abcdef
                             01234567-89ab-cdef-0123-456789abcdef
+            port:       open the radar device attached to the serial port port
+                        (see get_port_list)
         """
-        if uuid == None:
-            self.handle = dll.ifx_device_create()
+        if port != None:
+            self.handle = optional_function("ifx_device_create_by_port")(port.encode("ascii"))
+        elif uuid == None:
+            self.handle = get_dll().ifx_device_create()
         else:
             # remove - from uuid
             uuid = uuid.replace("-", "")
@@ -351,7 +466,7 @@ class Device():
 
             uuid_array = c_uint8 *16
             c_array = uuid_array(*uuid_bytes)
-            self.handle = dll.ifx_device_create_by_uuid(c_array)
+            self.handle = get_dll().ifx_device_create_by_uuid(c_array)
 
         # check return code
         check_rc()
@@ -453,7 +568,7 @@ class Device():
                                     if_gain_dB,
                                     frame_end_delay_100ps,
                                     shape_end_delay_100ps)
-        dll.ifx_device_set_config(self.handle, byref(config))
+        get_dll().ifx_device_set_config(self.handle, byref(config))
         check_rc()
 
     def get_next_frame(self, frame):
@@ -463,7 +578,7 @@ class Device():
         device. The samples from all chirps and all enabled RX antennas will be
         copied to the provided data structure frame.
         """
-        ret = dll.ifx_device_get_next_frame(self.handle, frame.handle)
+        ret = get_dll().ifx_device_get_next_frame(self.handle, frame.handle)
         check_rc(ret)
 
     def create_frame_from_device_handle(self):
@@ -473,7 +588,7 @@ class Device():
         device and initializes a data structure that can hold a time domain
         data frame according acquired through that device.
         """
-        frame_p = dll.ifx_device_create_frame_from_device_handle(self.handle)
+        frame_p = get_dll().ifx_device_create_frame_from_device_handle(self.handle)
         check_rc()
         return Frame.create_from_pointer(frame_p)
 
@@ -481,7 +596,7 @@ class Device():
         """Get the unique id for the radar shield"""
         uuid_array = c_uint8 *16
         c_array = uuid_array()
-        if dll.ifx_device_get_shield_uuid(self.handle, c_array):
+        if get_dll().ifx_device_get_shield_uuid(self.handle, c_array):
             uuid = ""
             for x in c_array:
                 uuid += "%02x" % x
@@ -492,4 +607,4 @@ class Device():
     def __del__(self):
         """Destroy device handle"""
         if hasattr(self, "handle"):
-            dll.ifx_device_destroy(self.handle)
+            get_dll().ifx_device_destroy(self.handle)
@@ -1,88 +1,476 @@
 from radar_config import RadarMetrics
-from ifxRadarSDK import *
-import json
-from copy import deepcopy
-from threading import Thread
+from radar_protocol import (
+    PACKET_CHIRP, PACKET_FRAME, PACKET_RANGE_DOPPLER, PACKET_VITAL_SIGNS, ADC_SCALE, RAW,
+    ENCODINGS, PayloadEncoder, send_packet, config_message, pack_json_packet
+)
+from range_doppler import RangeDopplerProcessor
+from clutter import ClutterFilter, CLUTTER_METHODS
+from vital_signs import VitalSignExtractor, VITAL_SIGNS_FIELDS
+from dsp import DigitalSignalProcessor
+from acquisition import AcquisitionThread, OverflowRecovery
+from capture import CaptureWriter
+from frame_buffer import FrameRingBuffer, FrameSender, DROP_OLDEST
+from functools import partial
+from telemetry import PIPELINE
+from numbers import Real
+from threading import Lock
+import numpy as np
 
-HEADER_LENGTH = 4
 BUFFER_MAX = 200
 
-def send_chirp(chirp, client):
-    serialized_packet = json.dumps(
-        { "packet_type": "chirp", "data": chirp }
-    )
-    packet_len = str(len(serialized_packet)).zfill(HEADER_LENGTH)
-    msg = bytes(packet_len + serialized_packet, 'utf-8')
-    client.sendall(msg)
+def send_chirp(chirp, client, sequence=0, timestamp=None, encoder=RAW):
+    send_packet(client, PACKET_CHIRP, chirp, sequence, timestamp, encoder)
 
-def send_thread_func(buffer, client):
-    for chirp in buffer:
-        send_chirp(chirp, client)
-    return
+def send_frame(frame, client, sequence=0, timestamp=None, encoder=RAW):
+    send_packet(client, PACKET_FRAME, frame, sequence, timestamp, encoder)
+
+def send_range_doppler_map(rd_map, client, sequence=0, timestamp=None, encoder=RAW):
+    send_packet(client, PACKET_RANGE_DOPPLER, rd_map, sequence, timestamp, encoder)
+
+def send_vital_signs(vital_signs, client, sequence=0, timestamp=None, encoder=RAW):
+    '''
+        vital_signs is a float32 array ordered as VITAL_SIGNS_FIELDS[1:], the timestamp
+        goes in the packet header. Always sent as raw float32.
+    '''
+    send_packet(client, PACKET_VITAL_SIGNS, vital_signs, sequence, timestamp)
+
+def no_release():
+    pass
 
 class Radar:
-    
-    buffer = [0]*BUFFER_MAX
-    buffer_index = 0
 
-    def __init__(self, **kargs):
-        self.device = Device()
+    STREAM_MODES = ("chirp", "frame", "range_doppler", "vital_signs")
+
+    def __init__(self, stream_mode="chirp", antennas=None, chirps=None, device=None, encoding="float32", clutter_removal=None, vital_signs_interval=1.0, vital_signs_window=20.0, **kargs):
+        '''
+            stream_mode "chirp" sends the first chirp of rx antenna 0, "frame" sends the full
+            (num_rx, num_chirps, num_samples) cube and "range_doppler" sends the cropped
+            range-Doppler magnitude map of the cube. antennas and chirps select which rx
+            antennas (indices of the enabled antennas) and which chirps of each frame make
+            up the cube, all if None. Chirp selection is not allowed in range_doppler mode.
+            "vital_signs" sends breathing and heart rate estimates (see vital_signs) every
+            vital_signs_interval seconds instead of frame data, estimated from the last
+            vital_signs_window seconds.
+
+            encoding is the sample payload encoding announced in the config handshake
+            ("float32", "int16" or "int16_delta", see radar_protocol). Raw ADC data is
+            quantized to ADC steps, range-Doppler maps are scaled per packet.
+
+            clutter_removal is None or a clutter.ClutterFilter method ("background", "mti" or
+            "iir") applied to the range spectra in range_doppler and vital_signs mode.
+
+            device defaults to the first attached radar shield, any object with the
+            ifxRadarSDK.Device interface can be passed instead (e.g. radar_simulator.Device)
+        '''
+        if stream_mode not in self.STREAM_MODES:
+            raise ValueError("Unknown stream mode: {mode}".format(mode=stream_mode))
+        if clutter_removal is not None and clutter_removal not in CLUTTER_METHODS:
+            raise ValueError("Unknown clutter removal method: {method}".format(method=clutter_removal))
+        if device is None:
+            from ifxRadarSDK import Device
+            device = Device()
+        self.device = device
         self.metrics = RadarMetrics(**kargs)
         self.device.set_config(**self.metrics.config_dict)
+        self.recovery = OverflowRecovery(self.device, dict(self.metrics.config_dict))
         self.frame = self.device.create_frame_from_device_handle()
+        self.frame_matrices = self.matrix_views(self.frame)
+        self.sequence = -1
+        self.timestamp = None
+        self.stream_mode = stream_mode
+        self.encoder = PayloadEncoder(encoding, scale=ADC_SCALE if stream_mode in ("chirp", "frame") else None)
+        self.clutter_removal = clutter_removal
+        self.vital_signs_interval = vital_signs_interval
+        self.vital_signs_window = vital_signs_window
+        self.ring_buffer = None
+        self.acquisition = None
+        self.range_doppler = None
+        self.vital_signs = None
+        self.capture = None
+        self.pending_config = None
+        self.config_lock = Lock()
+        self.select(antennas, chirps)
+
+    def select(self, antennas=None, chirps=None):
+        num_rx = self.frame.get_num_rx()
+        num_chirps = self.metrics.num_chirps_per_frame
+        self.antennas = list(range(num_rx)) if antennas is None else [int(rx) for rx in antennas]
+        self.chirps = None if chirps is None else np.array(chirps, dtype=np.intp)
+        if not self.antennas or not all(0 <= rx < num_rx for rx in self.antennas):
+            raise ValueError("antennas must be indices in [0, {n})".format(n=num_rx))
+        if self.chirps is not None and (self.chirps.size == 0 or not np.all((self.chirps >= 0) & (self.chirps < num_chirps))):
+            raise ValueError("chirps must be indices in [0, {n})".format(n=num_chirps))
+
+        shape = (
+            len(self.antennas),
+            num_chirps if self.chirps is None else len(self.chirps),
+            self.metrics.num_samples_per_chirp
+        )
+        self.frame_buffer = np.empty(shape, dtype=np.float32)
+
+        if self.stream_mode == "range_doppler":
+            if self.chirps is not None:
+                raise ValueError("The Doppler FFT needs every chirp of the frame")
+            self.range_doppler = RangeDopplerProcessor(self.metrics, clutter=self.clutter_filter())
+            self.range_doppler_map = np.empty(self.range_doppler.map_shape, dtype=np.float32)
+        elif self.stream_mode == "vital_signs":
+            self.dsp = DigitalSignalProcessor(self.metrics)
+            self.range_spectrum = np.empty(shape[:-1] + (self.dsp.num_bins, ), dtype=np.complex64)
+            self.vital_signs = VitalSignExtractor(
+                self.metrics,
+                self.dsp.range_axis(),
+                window_seconds=self.vital_signs_window,
+                update_interval=self.vital_signs_interval,
+            )
+            self.clutter = self.clutter_filter()
+            self.vital_signs_buffer = np.empty(len(VITAL_SIGNS_FIELDS) - 1, dtype=np.float32)
     
+    def clutter_filter(self):
+        if self.clutter_removal is None:
+            return None
+        return ClutterFilter(self.metrics, self.clutter_removal)
+
     def next_frame_data(self, rx=0):
-        self.device.get_next_frame(self.frame)
-        matrix = self.frame.get_mat_from_antenna(rx)
-        return matrix
+        matrices, release = self.read_frame()
+        try:
+            with PIPELINE.timer("extraction"):
+                return matrices[rx].copy()
+        finally:
+            release()
+
+    def next_frame_cube(self):
+        '''
+            Reads one frame and returns the selected (num_rx, num_chirps, num_samples) cube.
+            The returned array is reused by the next call.
+        '''
+        matrices, release = self.read_frame()
+        try:
+            with PIPELINE.timer("extraction"):
+                return self.fill_frame_buffer(matrices)
+        finally:
+            release()
+
+    def read_frame(self):
+        '''
+            Reads the next frame from the device, or from the acquisition thread if running.
+            Returns (matrices, release) where matrices[rx] is a view on the matrix of enabled
+            antenna rx, valid until release() is called. FIFO overflows are recovered from
+            (see acquisition.OverflowRecovery), the lost frames leave a gap in self.sequence.
+        '''
+        if self.acquisition is not None:
+            acquired = self.next_acquired_frame()
+            matrices, release = acquired.matrices, acquired.release
+        else:
+            self.sequence, self.timestamp = self.recovery.read(self.frame, self.sequence + 1)
+            matrices, release = self.frame_matrices, no_release
+        if self.capture is not None:
+            try:
+                self.record_frame(matrices)
+            except BaseException:
+                release()
+                raise
+        return matrices, release
+
+    def record_frame(self, matrices):
+        '''
+            Appends the frame to the capture file, the capture is stopped once the file is
+            full and streaming goes on
+        '''
+        self.capture.append(matrices, self.sequence, self.timestamp)
+        if self.capture.num_frames == self.capture.max_frames:
+            print("Capture file {path} is full, capture stopped after {n} frames".format(path=self.capture.path, n=self.capture.num_frames))
+            self.stop_capture()
+
+    def next_range_doppler_map(self):
+        '''
+            Returns the (velocity, range) map of the next frame, reused by the next call
+        '''
+        frame = self.next_frame_cube()
+        with PIPELINE.timer("dsp"):
+            return self.range_doppler.process(frame, out=self.range_doppler_map)
+
+    def next_vital_signs(self):
+        '''
+            Reads frames until the next vital signs estimate is due and returns it as a
+            float32 array (see send_vital_signs), reused by the next call. Returns None
+            early if a reconfiguration is pending.
+        '''
+        while self.pending_config is None:
+            frame = self.next_frame_cube()
+            with PIPELINE.timer("dsp"):
+                range_spectrum = self.dsp.range_fft(frame, out=self.range_spectrum)
+                if self.clutter is not None:
+                    self.clutter.process(range_spectrum)
+                estimate = self.vital_signs.add_frame(range_spectrum, self.timestamp)
+            if estimate is not None:
+                self.vital_signs_buffer[:] = estimate[1:]
+                return self.vital_signs_buffer
+
+    def fill_frame_buffer(self, matrices):
+        for i, rx in enumerate(self.antennas):
+            if self.chirps is None:
+                self.frame_buffer[i] = matrices[rx]
+            else:
+                np.take(matrices[rx], self.chirps, axis=0, out=self.frame_buffer[i])
+        return self.frame_buffer
+
+    def next_acquired_frame(self):
+        acquired = self.acquisition.get()
+        self.sequence = acquired.sequence
+        self.timestamp = acquired.timestamp
+        return acquired
+
+    def matrix_views(self, frame):
+        # the matrix memory of a frame does not move, so the views are created once
+        return [frame.get_mat_from_antenna(rx, copy=False) for rx in range(frame.get_num_rx())]
+
+    def start_capture(self, path, max_frames):
+        '''
+            Records every frame read from now on (all enabled antennas and chirps) with its
+            sequence number and timestamp to a memory-mapped capture file (see capture),
+            until max_frames are recorded
+        '''
+        self.stop_capture()
+        shape = (self.frame.get_num_rx(), self.metrics.num_chirps_per_frame, self.metrics.num_samples_per_chirp)
+        self.capture = CaptureWriter(path, self.metrics, shape, max_frames)
+
+    def stop_capture(self):
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
+
+    def start_acquisition(self, pool_size=4):
+        '''
+            Acquires frames on a dedicated thread from now on (see acquisition), the
+            next_frame_* methods then return frames from its pool
+        '''
+        self.stop_acquisition()
+        self.acquisition = AcquisitionThread(self.device, pool_size, first_sequence=self.sequence + 1, recovery=self.recovery)
+        self.acquisition.start()
+
+    def stop_acquisition(self):
+        if self.acquisition is not None:
+            self.acquisition.stop()
+            self.sequence = self.acquisition.sequence - 1
+            self.acquisition = None
 
     def refresh(self):
+        pool_size = None if self.acquisition is None else self.acquisition.pool_size
+        self.stop_acquisition()
         self.frame = self.device.create_frame_from_device_handle()
+        self.frame_matrices = self.matrix_views(self.frame)
+        self.select(self.antennas, self.chirps)
+        if pool_size is not None:
+            self.start_acquisition(pool_size)
 
-    def start_data_stream(self, client_socket):
+    def start_stream(self, client_socket):
+        '''
+            Streams until the client fails. The per mode stream methods return when a
+            reconfiguration is pending, it is applied between two frames and streaming goes
+            on in the (possibly new) mode.
+        '''
         while True:
+            if self.stream_mode == "frame":
+                self.start_frame_stream(client_socket)
+            elif self.stream_mode == "range_doppler":
+                self.start_range_doppler_stream(client_socket)
+            elif self.stream_mode == "vital_signs":
+                self.start_vital_signs_stream(client_socket)
+            else:
+                self.start_data_stream(client_socket)
+            self.apply_reconfiguration(client_socket)
+
+    def start_data_stream(self, client_socket):
+        while self.pending_config is None:
             chirp = self.fetch_first_chirp()
-            send_chirp(chirp, client_socket)
+            send_chirp(chirp, client_socket, self.sequence, self.timestamp, self.encoder)
 
-    def start_buffered_data_stream(self, client_socket):
+    def start_frame_stream(self, client_socket):
+        while self.pending_config is None:
+            frame = self.next_frame_cube()
+            send_frame(frame, client_socket, self.sequence, self.timestamp, self.encoder)
+
+    def start_range_doppler_stream(self, client_socket):
+        while self.pending_config is None:
+            rd_map = self.next_range_doppler_map()
+            send_range_doppler_map(rd_map, client_socket, self.sequence, self.timestamp, self.encoder)
+
+    def start_vital_signs_stream(self, client_socket):
+        while self.pending_config is None:
+            vital_signs = self.next_vital_signs()
+            if vital_signs is not None:
+                send_vital_signs(vital_signs, client_socket, self.sequence, self.timestamp)
+
+    def start_buffered_data_stream(self, client_socket, slots=BUFFER_MAX, policy=DROP_OLDEST):
+        '''
+            Acquisition only copies frames into a preallocated ring buffer, a single sender
+            thread drains it to the socket. policy decides what happens when the sender falls
+            behind (see frame_buffer), drop counts are kept in self.ring_buffer. A pending
+            reconfiguration is applied once the sender has sent every buffered frame.
+        '''
         while True:
-            chirp = self.fetch_first_chirp()
-            if self.buffer_index < len(self.buffer):
-                self.buffer[self.buffer_index] = chirp
-                self.buffer_index += 1
+            if self.stream_mode == "frame":
+                fetch, send, shape = self.next_frame_cube, send_frame, self.frame_buffer.shape
+            elif self.stream_mode == "range_doppler":
+                fetch, send, shape = self.next_range_doppler_map, send_range_doppler_map, self.range_doppler_map.shape
+            elif self.stream_mode == "vital_signs":
+                fetch, send, shape = self.next_vital_signs, send_vital_signs, self.vital_signs_buffer.shape
             else:
-                self.buffer_index = 0
-                buffer_copy = deepcopy(self.buffer)
-                send_thread = Thread(target=send_thread_func, args=(buffer_copy, client_socket))
-                send_thread.start()
+                fetch, send, shape = self.fetch_first_chirp, send_chirp, (self.metrics.num_samples_per_chirp, )
+
+            self.ring_buffer = FrameRingBuffer(slots, shape, np.float32, policy)
+            sender = FrameSender(self.ring_buffer, partial(send, encoder=self.encoder), client_socket)
+            sender.start()
+            try:
+                while sender.is_alive() and self.pending_config is None:
+                    data = fetch()
+                    if data is not None:
+                        self.ring_buffer.push(data, self.sequence, self.timestamp)
+            finally:
+                self.ring_buffer.close()
+                sender.join()
+            if sender.error is not None:
+                raise sender.error
+            if self.pending_config is None:
+                return
+            self.apply_reconfiguration(client_socket)
+
+    def request_reconfiguration(self, metrics=None, stream_mode=None, encoding=None):
+        '''
+            Validates a new configuration and schedules it, the stream applies it at the next
+            frame boundary. metrics is a RadarMetrics or a dict of RadarMetrics parameters,
+            which updates the current parameters. None keeps the current value. Raises
+            ValueError for an invalid configuration. Safe to call from any thread.
+        '''
+        if isinstance(metrics, dict):
+            metrics = self.validate_metrics(metrics)
+        if stream_mode is not None and stream_mode not in self.STREAM_MODES:
+            raise ValueError("Unknown stream mode: {mode}".format(mode=stream_mode))
+        if encoding is not None and encoding not in ENCODINGS:
+            raise ValueError("Unknown encoding: {encoding}".format(encoding=encoding))
+        with self.config_lock:
+            self.pending_config = (metrics, stream_mode, encoding)
+
+    def validate_metrics(self, parameters):
+        unknown = set(parameters) - set(RadarMetrics.PARAMETERS)
+        if unknown:
+            raise ValueError("Unknown radar parameters: {names}".format(names=sorted(unknown)))
+        for name, value in parameters.items():
+            if not isinstance(value, Real) or isinstance(value, bool) or value < 0:
+                raise ValueError("{name} must be a non-negative number".format(name=name))
+        metrics = RadarMetrics(**dict(self.metrics.parameters, **parameters))
+        if metrics.min_range >= metrics.max_range:
+            raise ValueError("min_range must be smaller than max_range")
+        if metrics.num_samples_per_chirp < 2 or metrics.num_chirps_per_frame < 2:
+            raise ValueError("The configuration needs at least 2 samples per chirp and 2 chirps per frame")
+        return metrics
+
+    def apply_reconfiguration(self, client_socket):
+        '''
+            Applies the pending configuration and sends the new config packet to
+            client_socket. If the device rejects the configuration, the previous one is
+            restored. Returns True if a new configuration was applied.
+        '''
+        with self.config_lock:
+            pending, self.pending_config = self.pending_config, None
+        if pending is None:
+            return False
+        metrics, stream_mode, encoding = pending
+        previous = (self.metrics, self.stream_mode, self.encoder.name)
+        try:
+            self.configure(metrics or self.metrics, stream_mode or self.stream_mode, encoding or self.encoder.name)
+        except Exception as e:
+            print("Reconfiguration failed, restoring the previous configuration: {error}".format(error=e))
+            self.configure(*previous)
+            return False
+        self.send_config_update(client_socket)
+        return True
+
+    def configure(self, metrics, stream_mode, encoding):
+        pool_size = None if self.acquisition is None else self.acquisition.pool_size
+        self.stop_acquisition()
+        if metrics != self.metrics:
+            # a capture file holds frames of one configuration only
+            self.stop_capture()
+            self.device.set_config(**metrics.config_dict)
+            self.recovery = OverflowRecovery(self.device, dict(metrics.config_dict))
+            self.metrics = metrics
+            # the number of antennas and chirps may change
+            self.antennas = None
+            self.chirps = None
+        self.stream_mode = stream_mode
+        self.encoder = PayloadEncoder(encoding, scale=ADC_SCALE if stream_mode in ("chirp", "frame") else None)
+        self.range_doppler = None
+        self.vital_signs = None
+        self.refresh()
+        if pool_size is not None:
+            self.start_acquisition(pool_size)
+
+    def send_config_update(self, client_socket):
+        '''
+            StreamServer also makes the new config packet the handshake of new clients
+        '''
+        if hasattr(client_socket, "update_handshake"):
+            client_socket.update_handshake(self.config_packet())
+        else:
+            client_socket.sendall(self.config_packet())
+
+    def handle_control_message(self, message):
+        '''
+            Control handler for StreamServer.set_control_handler:
+
+                {"command": "configure", "metrics": {...}, "mode": ..., "encoding": ...}
+        '''
+        if message.get("command") != "configure":
+            raise ValueError("Unknown command: {command}".format(command=message.get("command")))
+        self.request_reconfiguration(message.get("metrics"), message.get("mode"), message.get("encoding"))
+        return {"packet_type": "control_ack", "command": "configure", "status": "scheduled"}
+
+    def metrics_samples(self):
+        '''
+            Gauge samples for telemetry.PIPELINE.add_collector
+        '''
+        samples = [
+            ("fifo_overflows", {}, self.recovery.overflows),
+            ("lost_frames", {}, self.recovery.lost_frames),
+            ("sequence", {}, self.sequence),
+        ]
+        if self.acquisition is not None:
+            samples.append(("acquisition_ready_frames", {}, len(self.acquisition.ready)))
+            samples.append(("acquisition_dropped_frames", {}, self.acquisition.dropped))
+        if self.ring_buffer is not None:
+            for name, value in self.ring_buffer.stats().items():
+                samples.append(("ring_buffer_" + name, {}, value))
+        return samples
 
     def fetch_first_chirp(self):
         frame_data = self.next_frame_data()
-        first_chirp = frame_data[0].tolist()
-        return first_chirp
+        return frame_data[0]
     
-    def send_config_packet(self, client_socket):
-        serialized_config = json.dumps({
-            "packet_type": "config",
-            "data": {
-                "range_resolution": self.metrics.range_resolution,
-                "max_range": self.metrics.actual_max_range,
-                "min_range": self.metrics.min_range,
-                "speed_resolution": self.metrics.speed_resolution,
-                "max_speed": self.metrics.actual_max_velocity,
-                "frame_rate": self.metrics.frame_rate,
-                "adc_sample_rate_hz": self.metrics.adc_sample_rate_hz,
-                "rx_antenna_number": self.metrics.rx_antenna_number,
-                "center_frequency": self.metrics.center_frequency,
-                "num_samples_per_chirp": self.metrics.num_samples_per_chirp,
-                "num_chirps_per_frame": self.metrics.num_chirps_per_frame,
-                "lower_frequency": self.metrics.lower_frequency,
-                "upper_frequency": self.metrics.upper_frequency,
-                "bandwidth": self.metrics.bandwidth
-            }
-        })
-        packet_len = str(len(serialized_config))
-        packet_len = packet_len.zfill(HEADER_LENGTH)
-        msg = bytes(packet_len + serialized_config, 'utf-8')
-        client_socket.sendall(msg)
+    def stream_config(self):
+        config = {
+            "mode": self.stream_mode,
+            "encoding": self.encoder.name,
+            "antennas": self.antennas,
+            "chirps": None if self.chirps is None else self.chirps.tolist(),
+            "frame_shape": list(self.frame_buffer.shape),
+            "clutter_removal": self.clutter_removal,
+        }
+        if self.range_doppler is not None:
+            config["map_shape"] = list(self.range_doppler.map_shape)
+            config["range_axis"] = self.range_doppler.range_axis.tolist()
+            config["velocity_axis"] = self.range_doppler.velocity_axis.tolist()
+        if self.vital_signs is not None:
+            config["vital_signs_fields"] = VITAL_SIGNS_FIELDS[1:]
+            config["update_interval"] = self.vital_signs.update_length / self.vital_signs.frame_rate
+            config["window_seconds"] = self.vital_signs.window_length / self.vital_signs.frame_rate
+        return config
+
+    def config_message(self):
+        return config_message(self.metrics, self.stream_config())
 
+    def config_packet(self):
+        return pack_json_packet(self.config_message())
+
+    def send_config_packet(self, client_socket):
+        client_socket.sendall(self.config_packet())
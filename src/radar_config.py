@@ -1,3 +1,4 @@
+from types import MappingProxyType
 from radar_tools import highest_power_of_two, C
 
 class RadarMetrics:
@@ -22,6 +23,35 @@ class RadarMetrics:
         "shape_end_delay_100ps": 1500000,
     }
 
+    PARAMETERS = (
+        "range_resolution",
+        "max_range",
+        "min_range",
+        "speed_resolution",
+        "max_speed",
+        "frame_rate",
+        "adc_sample_rate_hz",
+        "bgt_tx_power",
+        "rx_antenna_number",
+        "if_gain_db",
+        "center_frequency",
+    )
+
+    __slots__ = PARAMETERS + (
+        "num_chirps_per_frame",
+        "num_samples_per_chirp",
+        "chirp_to_chirp_time_100ps",
+        "bandwidth",
+        "lower_frequency",
+        "upper_frequency",
+        "chirp_length",
+        "chirp_slope",
+        "actual_max_range",
+        "actual_max_velocity",
+        "__config",
+        "__key",
+    )
+
     def __init__(
         self,
         range_resolution=None,
@@ -36,39 +66,28 @@ class RadarMetrics:
         if_gain_db=None,
         center_frequency=None,
     ):
-        self.__config = self.DEFAULT_CONFIG
+        '''
+            RadarMetrics are immutable: every derived value is computed once here. Instances
+            with the same parameters are equal and hash alike, so they can key caches of
+            per-configuration data (see dsp_plan).
+        '''
+        set_value = super().__setattr__
         '''
             The below radar metrics come from Mackenzie Goodwin's implementation for breathing rate detection (Dr. Shaker's Lab)
             Can be found here: https://github.com/mackenzieg/radar_infineon_sdk/blob/master/src/radar_config.cpp
         '''
-        self.range_resolution = range_resolution or 0.1 # m
-        self.max_range = max_range or 2.5 # m
-        self.min_range = min_range or 0.2 # m
-        self.speed_resolution = speed_resolution or 0.2 # m/s
-        self.max_speed = max_speed or 2.0 # m/s
-        self.frame_rate = frame_rate or 32 # Hz (I think)
-        self.adc_sample_rate_hz = adc_sample_rate_hz or 1000000 # 1,000,000 Hz
-        self.bgt_tx_power = bgt_tx_power or 31
-        self.rx_antenna_number = rx_antenna_number or self.RX_2
-        self.if_gain_db = if_gain_db or 33
-        self.center_frequency = center_frequency or 60500000000 # 60,500,000,000 Hz
-
-        self.apply_config()
-
-    def apply_config(self):
-        self.__config["lower_frequency_kHz"] = int(0.001 * self.lower_frequency)
-        self.__config["upper_frequency_kHz"] = int(0.001 * self.upper_frequency)
-        self.__config["num_samples_per_chirp"] = self.num_samples_per_chirp
-        self.__config["chirp_to_chirp_time_100ps"] = self.chirp_to_chirp_time_100ps
-        self.__config["num_chirps_per_frame"] = self.num_chirps_per_frame
-        self.__config["frame_period_us"] = int(1.0e6 / self.frame_rate)
-        self.__config["adc_samplerate_Hz"] = self.adc_sample_rate_hz
-        self.__config["bgt_tx_power"] = self.bgt_tx_power
-        self.__config["rx_antenna_mask"] = self.rx_antenna_number
-        self.__config["if_gain_dB"] = self.if_gain_db
-    
-    @property
-    def num_chirps_per_frame(self):
+        set_value("range_resolution", range_resolution or 0.1) # m
+        set_value("max_range", max_range or 2.5) # m
+        set_value("min_range", min_range or 0.2) # m
+        set_value("speed_resolution", speed_resolution or 0.2) # m/s
+        set_value("max_speed", max_speed or 2.0) # m/s
+        set_value("frame_rate", frame_rate or 32) # Hz (I think)
+        set_value("adc_sample_rate_hz", adc_sample_rate_hz or 1000000) # 1,000,000 Hz
+        set_value("bgt_tx_power", bgt_tx_power or 31)
+        set_value("rx_antenna_number", rx_antenna_number or self.RX_2)
+        set_value("if_gain_db", if_gain_db or 33)
+        set_value("center_frequency", center_frequency or 60500000000) # 60,500,000,000 Hz
+
         '''
             The number of bins multiplied with the speed resolution results in the maximum speed. The
             bins of the Doppler transforms represent the -v_max...v_max, that's why the maximum speed
@@ -77,11 +96,8 @@ class RadarMetrics:
             Doppler transform is an FFT, and usually FFT sizes are powers of 2. If number of samples is
             not a power of two, the FFT input could be zero padded. 
         '''
-        num_chirps_per_frame = int(2.0 * self.max_speed / self.speed_resolution)
-        return highest_power_of_two(num_chirps_per_frame)
+        set_value("num_chirps_per_frame", highest_power_of_two(int(2.0 * self.max_speed / self.speed_resolution)))
 
-    @property
-    def num_samples_per_chirp(self):
         '''
             The number of bins multiplied with the range resolution results in the total range. Due to
             Nyquist theorem only half of the spectrum is evaluated in range transform so the total range
@@ -90,54 +106,68 @@ class RadarMetrics:
             Range transform is an FFT, and usually FFT sizes are powers of 2. If number of samples is
             not a power of two, the FFT input could be zero padded.
         '''
-        num_samples_per_chirp = int(2.0 * self.max_range / self.range_resolution)
-        return highest_power_of_two(num_samples_per_chirp)
-
-    @property
-    def chirp_to_chirp_time_100ps(self):
-        '''
-            Formula provided by algorithm team, information can be found in some papers
-        '''
-        return int(1.0e10 * C / (4.0 * self.max_speed * self.center_frequency))
-
-    @property
-    def lower_frequency(self):
-        return self.center_frequency - int(self.bandwidth * 0.5)
-
-    @property
-    def upper_frequency(self):
-        return self.center_frequency + int(self.bandwidth * 0.5)
-
-    @property
-    def bandwidth(self):
-        return C / (2 * self.range_resolution)
-    
-    @property
-    def chirp_length(self):
-        return self.num_samples_per_chirp / self.adc_sample_rate_hz
+        set_value("num_samples_per_chirp", highest_power_of_two(int(2.0 * self.max_range / self.range_resolution)))
+
+        # Formula provided by algorithm team, information can be found in some papers
+        set_value("chirp_to_chirp_time_100ps", int(1.0e10 * C / (4.0 * self.max_speed * self.center_frequency)))
+
+        set_value("bandwidth", C / (2 * self.range_resolution))
+        set_value("lower_frequency", self.center_frequency - int(self.bandwidth * 0.5))
+        set_value("upper_frequency", self.center_frequency + int(self.bandwidth * 0.5))
+        set_value("chirp_length", self.num_samples_per_chirp / self.adc_sample_rate_hz)
+        set_value("chirp_slope", self.bandwidth / self.chirp_length)
+
+        # The actual max range and velocity will be larger due to rounding num_samples_per_chirp
+        # and num_chirps_per_frame up to the nearest power of two
+        set_value("actual_max_range", self.num_samples_per_chirp * self.range_resolution / 2.0)
+        set_value("actual_max_velocity", self.num_chirps_per_frame * self.speed_resolution / 2.0)
+
+        config = dict(self.DEFAULT_CONFIG)
+        config["lower_frequency_kHz"] = int(0.001 * self.lower_frequency)
+        config["upper_frequency_kHz"] = int(0.001 * self.upper_frequency)
+        config["num_samples_per_chirp"] = self.num_samples_per_chirp
+        config["chirp_to_chirp_time_100ps"] = self.chirp_to_chirp_time_100ps
+        config["num_chirps_per_frame"] = self.num_chirps_per_frame
+        config["frame_period_us"] = int(1.0e6 / self.frame_rate)
+        config["adc_samplerate_Hz"] = self.adc_sample_rate_hz
+        config["bgt_tx_power"] = self.bgt_tx_power
+        config["rx_antenna_mask"] = self.rx_antenna_number
+        config["if_gain_dB"] = self.if_gain_db
+        set_value("_RadarMetrics__config", MappingProxyType(config))
+        set_value("_RadarMetrics__key", tuple(getattr(self, name) for name in self.PARAMETERS))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RadarMetrics is immutable, create a new instance instead")
+
+    def __delattr__(self, name):
+        raise AttributeError("RadarMetrics is immutable")
+
+    def __eq__(self, other):
+        return isinstance(other, RadarMetrics) and self.__key == other.__key
+
+    def __hash__(self):
+        return hash(self.__key)
+
+    def __reduce__(self):
+        return (RadarMetrics, self.__key)
+
+    def __repr__(self):
+        return "RadarMetrics({parameters})".format(
+            parameters=", ".join("{0}={1!r}".format(name, value) for name, value in zip(self.PARAMETERS, self.__key))
+        )
 
     @property
-    def chirp_slope(self):
-        return self.bandwidth / self.chirp_length
-    
-    @property
-    def actual_max_range(self):
+    def parameters(self):
         '''
-            The actual max range will be larger due to increasing num_samples_per_chirp
-            to the nearest power of two
+            Keyword arguments that recreate these metrics
         '''
-        return self.num_samples_per_chirp * self.range_resolution / 2.0
+        return dict(zip(self.PARAMETERS, self.__key))
 
     @property
-    def actual_max_velocity(self):
+    def config_dict(self):
         '''
-            The actual max velocity will be larger due to increasing num_samples_per_chirp
-            to the nearest power of two
+            Read-only mapping of the ifxRadarSDK.Device.set_config arguments
         '''
-        return self.num_chirps_per_frame * self.speed_resolution / 2.0
-
-    @property
-    def config_dict(self):
         return self.__config
 
     def __str__(self):
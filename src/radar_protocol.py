@@ -0,0 +1,371 @@
+'''
+    Binary wire protocol for the radar data stream.
+
+    The handshake is still a JSON config packet with a 4 digit ASCII length prefix, so
+    existing clients keep working and can detect the binary format through the
+    "wire_format" entry of the config. Every packet after the handshake is a fixed size
+    little-endian header followed by the sample bytes of a numpy array.
+
+    When the radar is reconfigured while streaming, a new JSON config packet is sent between
+    two binary packets. Readers tell them apart by the first 4 bytes: the MAGIC of a binary
+    header or the ASCII digits of a JSON length prefix (see recv_message). Clients may send
+    JSON control packets the same way (see stream_server).
+
+    The payload encoding is announced in the handshake and repeated in every header:
+
+        float32         raw samples, sent straight from the numpy buffer (also used for
+                        any non float32 data)
+        int16           samples quantized to value = q * scale + offset
+        int16_delta     int16 with the difference of consecutive samples of each chirp,
+                        byte shuffled and zlib compressed (lossless on the int16 values)
+
+    For ADC data the int16 scale is one 12 bit ADC step, so both int16 encodings are
+    lossless on SDK samples. Other data is scaled per packet to its value range.
+'''
+from collections import namedtuple
+import json
+import struct
+import zlib
+import numpy as np
+import timestamps
+from telemetry import PIPELINE
+
+HEADER_LENGTH = 4 # length prefix of the JSON config packet
+
+MAGIC = b'RTVD'
+PROTOCOL_VERSION = 2
+MAX_DIMS = 4
+
+# packet types
+PACKET_CHIRP = 1
+PACKET_FRAME = 2
+PACKET_RANGE_DOPPLER = 3
+PACKET_VITAL_SIGNS = 4
+PACKET_SPEED = 5
+
+# sample data types, always sent little-endian
+DTYPES = {
+    1: np.dtype('<f4'),
+    2: np.dtype('<i2'),
+    3: np.dtype('<c8'),
+    4: np.dtype('<u1'),
+}
+DTYPE_CODES = {dtype: code for code, dtype in DTYPES.items()}
+
+# payload encodings
+ENCODING_RAW = 0
+ENCODING_INT16 = 1
+ENCODING_INT16_DELTA = 2
+ENCODINGS = {
+    "float32": ENCODING_RAW,
+    "int16": ENCODING_INT16,
+    "int16_delta": ENCODING_INT16_DELTA,
+}
+ENCODING_NAMES = {code: name for name, code in ENCODINGS.items()}
+
+ADC_SCALE = 1.0 / 4095 # one step of the 12 bit ADC in SDK sample units
+INT16 = np.dtype('<i2')
+
+'''
+    magic (4s), version (B), packet_type (B), dtype (B), ndim (B), sequence (I),
+    timestamp [s, timestamps.now() clock] (d), shape (4 x I), payload_length [bytes] (I), encoding (B), device (B),
+    padding (2x), scale (d), offset (d)
+
+    dtype and shape describe the decoded samples, payload_length the encoded bytes. device
+    identifies the radar when several are multiplexed onto one stream, it is 0 otherwise
+    (the byte used to be padding, so single device streams are unchanged).
+'''
+HEADER_STRUCT = struct.Struct('<4sBBBBIdIIIIIBB2xdd')
+HEADER_SIZE = HEADER_STRUCT.size
+DEVICE_OFFSET = struct.calcsize('<4sBBBBIdIIIIIB')
+
+PacketHeader = namedtuple(
+    'PacketHeader',
+    ['version', 'packet_type', 'dtype', 'shape', 'sequence', 'timestamp', 'payload_length', 'encoding', 'scale', 'offset', 'device']
+)
+
+class ProtocolError(Exception):
+    pass
+
+def wire_format():
+    '''
+        Description of the binary framing, sent with the config packet
+    '''
+    return {
+        "name": "binary",
+        "version": PROTOCOL_VERSION,
+        "magic": MAGIC.decode('ascii'),
+        "header_size": HEADER_SIZE,
+        "byte_order": "little",
+        "dtypes": {code: dtype.str for code, dtype in DTYPES.items()},
+        "encodings": ENCODINGS,
+    }
+
+def as_wire_array(data):
+    '''
+        Returns data as a C contiguous little-endian array. No copy is made if data
+        already has that layout, which is the case for matrices from the SDK.
+    '''
+    data = np.ascontiguousarray(data)
+    if data.dtype.byteorder == '>':
+        data = data.astype(data.dtype.newbyteorder('<'))
+    if data.dtype not in DTYPE_CODES:
+        raise ProtocolError("Unsupported sample type: {dtype}".format(dtype=data.dtype))
+    if data.ndim > MAX_DIMS:
+        raise ProtocolError("Arrays with more than {n} dimensions are not supported".format(n=MAX_DIMS))
+    return data
+
+def pack_header(packet_type, data, sequence, timestamp=None, payload_length=None, encoding=ENCODING_RAW, scale=1.0, offset=0.0, device=0):
+    '''
+        data is the (decoded) sample array the header describes
+    '''
+    if timestamp is None:
+        timestamp = timestamps.now()
+    if payload_length is None:
+        payload_length = data.nbytes
+    shape = tuple(data.shape) + (0,)*(MAX_DIMS - data.ndim)
+    return HEADER_STRUCT.pack(
+        MAGIC,
+        PROTOCOL_VERSION,
+        packet_type,
+        DTYPE_CODES[data.dtype],
+        data.ndim,
+        sequence & 0xFFFFFFFF,
+        timestamp,
+        *shape,
+        payload_length,
+        encoding,
+        device,
+        scale,
+        offset
+    )
+
+def unpack_header(buffer):
+    magic, version, packet_type, dtype_code, ndim, sequence, timestamp, *rest = HEADER_STRUCT.unpack_from(buffer)
+    if magic != MAGIC:
+        raise ProtocolError("Bad packet magic: {magic}".format(magic=magic))
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError("Unsupported protocol version: {version}".format(version=version))
+    if dtype_code not in DTYPES:
+        raise ProtocolError("Unknown sample type code: {code}".format(code=dtype_code))
+    shape = tuple(rest[:ndim])
+    payload_length, encoding, device, scale, offset = rest[MAX_DIMS:]
+    if encoding not in ENCODING_NAMES:
+        raise ProtocolError("Unknown payload encoding: {encoding}".format(encoding=encoding))
+    return PacketHeader(version, packet_type, DTYPES[dtype_code], shape, sequence, timestamp, payload_length, encoding, scale, offset, device)
+
+def set_device(header, device):
+    '''
+        Returns a copy of the packed header with the device id replaced
+    '''
+    header = bytearray(header)
+    header[DEVICE_OFFSET] = device
+    return header
+
+def decode_payload(header, payload):
+    '''
+        Returns the samples of a packet. float32 payloads are returned as a read-only view
+        on payload (no copy), int16 payloads are dequantized.
+    '''
+    if len(payload) != header.payload_length:
+        raise ProtocolError("Payload length mismatch")
+    if header.encoding == ENCODING_RAW:
+        return np.frombuffer(payload, dtype=header.dtype).reshape(header.shape)
+
+    if header.encoding == ENCODING_INT16_DELTA:
+        shuffled = np.frombuffer(zlib.decompress(payload), dtype=np.uint8)
+        deltas = shuffled.reshape(2, -1).T.copy().view(INT16).reshape(header.shape)
+        # int16 arithmetic wraps, so the cumulative sum restores the samples exactly
+        quantized = np.cumsum(deltas, axis=-1, dtype=INT16)
+    else:
+        quantized = np.frombuffer(payload, dtype=INT16).reshape(header.shape)
+    samples = quantized * header.scale + header.offset
+    return samples.astype(header.dtype)
+
+class PayloadEncoder:
+    '''
+        Encodes sample arrays for send_packet. The int16 buffers are reused between packets
+        of the same shape.
+    '''
+    def __init__(self, encoding="float32", scale=None, compression_level=1):
+        '''
+            scale is the int16 quantization step, e.g. ADC_SCALE for SDK samples. If None,
+            every packet is scaled to the value range of its samples.
+        '''
+        if encoding not in ENCODINGS:
+            raise ValueError("Unknown payload encoding: {encoding}".format(encoding=encoding))
+        self.name = encoding
+        self.encoding = ENCODINGS[encoding]
+        self.scale = scale
+        self.compression_level = compression_level
+        self.work = None
+        self.quantized = None
+        self.deltas = None
+
+    def encode(self, data):
+        '''
+            Returns (payload, scale, offset). payload is a view on data for float32.
+        '''
+        if self.encoding == ENCODING_RAW or data.dtype != np.float32:
+            return memoryview(data).cast('B'), 1.0, 0.0
+
+        if self.quantized is None or self.quantized.shape != data.shape:
+            self.work = np.empty(data.shape, dtype=np.float32)
+            self.quantized = np.empty(data.shape, dtype=INT16)
+            self.deltas = np.empty(data.shape, dtype=INT16)
+        if self.scale is not None:
+            scale, offset = self.scale, 0.0
+            np.multiply(data, 1.0 / scale, out=self.work)
+            np.clip(self.work, -32768, 32767, out=self.work)
+        else:
+            low, high = float(data.min()), float(data.max())
+            offset = 0.5 * (low + high)
+            scale = (high - low) / 65534 or 1.0
+            np.subtract(data, offset, out=self.work)
+            np.multiply(self.work, 1.0 / scale, out=self.work)
+        np.rint(self.work, out=self.quantized, casting='unsafe')
+
+        if self.encoding == ENCODING_INT16:
+            return memoryview(self.quantized).cast('B'), scale, offset
+
+        self.deltas[..., 0] = self.quantized[..., 0]
+        np.subtract(self.quantized[..., 1:], self.quantized[..., :-1], out=self.deltas[..., 1:])
+        # low bytes then high bytes, the high bytes of small deltas compress well
+        shuffled = self.deltas.view(np.uint8).reshape(-1, 2).T
+        payload = zlib.compress(np.ascontiguousarray(shuffled), self.compression_level)
+        return payload, scale, offset
+
+RAW = PayloadEncoder()
+
+def send_packet(client, packet_type, data, sequence, timestamp=None, encoder=RAW):
+    '''
+        Sends the header and then the payload. Raw float32 samples are sent straight from
+        the numpy buffer.
+
+        client is a socket or a packet sink with a write_packet(header, payload) method
+        (e.g. stream_server.StreamServer). payload is only valid during that call. A socket
+        gets header and payload in one sendmsg.
+    '''
+    with PIPELINE.timer("serialization"):
+        data = as_wire_array(data)
+        payload, scale, offset = encoder.encode(data)
+        encoding = encoder.encoding if data.dtype == np.float32 else ENCODING_RAW
+        header = pack_header(packet_type, data, sequence, timestamp, len(payload), encoding, scale, offset)
+    if hasattr(client, "write_packet"):
+        # the sink times its own socket writes (e.g. StreamServer)
+        with PIPELINE.timer("sink"):
+            client.write_packet(header, payload)
+    else:
+        with PIPELINE.timer("send"):
+            send_buffers(client, (header, payload))
+    if timestamp is not None:
+        PIPELINE.histogram("latency").observe(timestamps.now() - timestamp)
+    PIPELINE.count("packets_total")
+    PIPELINE.count("bytes_total", len(header) + len(payload))
+
+def send_buffers(sock, buffers):
+    '''
+        sendall of several buffers with scatter-gather sendmsg, without joining them
+    '''
+    if not hasattr(sock, "sendmsg"):
+        for buffer in buffers:
+            sock.sendall(buffer)
+        return
+    buffers = byte_views(buffers)
+    while buffers:
+        consume_buffers(buffers, sock.sendmsg(buffers))
+
+def byte_views(buffers):
+    return [memoryview(buffer).cast("B") for buffer in buffers]
+
+def consume_buffers(buffers, sent):
+    '''
+        Removes the first sent bytes from the list of byte memoryviews buffers, after a
+        partial sendmsg
+    '''
+    index = 0
+    while index < len(buffers) and sent >= len(buffers[index]):
+        sent -= len(buffers[index])
+        index += 1
+    del buffers[:index]
+    if buffers:
+        buffers[0] = buffers[0][sent:]
+
+def pack_json_packet(packet):
+    serialized_packet = json.dumps(packet)
+    packet_len = str(len(serialized_packet)).zfill(HEADER_LENGTH)
+    if len(packet_len) > HEADER_LENGTH:
+        raise ProtocolError("JSON packet is too large for a {n} digit header".format(n=HEADER_LENGTH))
+    return bytes(packet_len + serialized_packet, 'utf-8')
+
+def config_packet(metrics, stream=None):
+    return pack_json_packet(config_message(metrics, stream))
+
+def config_message(metrics, stream=None):
+    return {
+        "packet_type": "config",
+        "wire_format": wire_format(),
+        "clock": timestamps.clock_info(),
+        "stream": stream or {"mode": "chirp"},
+        "parameters": metrics.parameters,
+        "data": {
+            "range_resolution": metrics.range_resolution,
+            "max_range": metrics.actual_max_range,
+            "min_range": metrics.min_range,
+            "speed_resolution": metrics.speed_resolution,
+            "max_speed": metrics.actual_max_velocity,
+            "frame_rate": metrics.frame_rate,
+            "adc_sample_rate_hz": metrics.adc_sample_rate_hz,
+            "rx_antenna_number": metrics.rx_antenna_number,
+            "center_frequency": metrics.center_frequency,
+            "num_samples_per_chirp": metrics.num_samples_per_chirp,
+            "num_chirps_per_frame": metrics.num_chirps_per_frame,
+            "lower_frequency": metrics.lower_frequency,
+            "upper_frequency": metrics.upper_frequency,
+            "bandwidth": metrics.bandwidth
+        }
+    }
+
+def speed_config_packet():
+    return pack_json_packet({
+        "packet_type": "config",
+        "wire_format": wire_format(),
+        "clock": timestamps.clock_info(),
+        "stream": {"mode": "speed", "unit": "m/s"},
+    })
+
+def recv_exactly(client, length):
+    buffer = bytearray(length)
+    view = memoryview(buffer)
+    while len(view):
+        received = client.recv_into(view)
+        if not received:
+            raise ConnectionError("Connection closed")
+        view = view[received:]
+    return buffer
+
+def recv_json_packet(client):
+    packet_len = int(recv_exactly(client, HEADER_LENGTH))
+    return json.loads(recv_exactly(client, packet_len).decode('utf-8'))
+
+def recv_message(client):
+    '''
+        Returns (header, raw header bytes, payload bytes) of the next binary packet, or
+        (None, message, None) if the next packet is a JSON packet (e.g. a config update)
+    '''
+    prefix = recv_exactly(client, HEADER_LENGTH)
+    if bytes(prefix) != MAGIC:
+        if not prefix.isdigit():
+            raise ProtocolError("Bad packet start: {prefix}".format(prefix=bytes(prefix)))
+        return None, json.loads(recv_exactly(client, int(prefix)).decode('utf-8')), None
+    raw_header = prefix + recv_exactly(client, HEADER_SIZE - HEADER_LENGTH)
+    header = unpack_header(raw_header)
+    return header, raw_header, recv_exactly(client, header.payload_length)
+
+def recv_packet(client):
+    '''
+        Returns (header, raw header bytes, payload bytes) of the next binary packet
+    '''
+    raw_header = recv_exactly(client, HEADER_SIZE)
+    header = unpack_header(raw_header)
+    return header, raw_header, recv_exactly(client, header.payload_length)
@@ -1,44 +1,94 @@
 from radar import Radar
-import json
-import socket
+from stream_server import StreamServer
+from telemetry import PIPELINE, MetricsHTTPServer, StatsSender
+from shm_transport import SharedMemorySender
+from udp_transport import DatagramSender, PacketTee, parse_address
 import signal
 import sys
-import time
 
 # Constants
 HOST = "192.168.50.97" # Change this to raspberry Pi IP address (type "hostname -I" in rp terminal)
+QUEUE_SIZE = 64 # packets queued per client before the slow client policy applies
+SLOW_CLIENT_POLICY = "drop" # "drop" or "disconnect"
+COALESCE_BYTES = 65536 # packets waiting for a client are sent together in writes of up to this size
+LATENCY_BUDGET = 0.0 # [s] time a packet may wait for more packets to fill a write, 0 sends at once with TCP_NODELAY
+METRICS_PORT = 9100 # Prometheus metrics at http://HOST:METRICS_PORT/metrics, None to disable
+STATS_INTERVAL = None # [s] period of the JSON stats packet on the data stream, None to disable
+UDP_TARGET = None # "host:port" (unicast, or a multicast group like "239.0.0.1:5005") to also stream over UDP for live display, None to disable
+SHM_NAME = None # name of a shared memory ring (see shm_transport) for consumers on this host, None to disable
+VITAL_SIGNS_INTERVAL = 1.0 # [s] between two vital signs estimates in vital_signs mode
+VITAL_SIGNS_WINDOW = 20.0 # [s] of phase history each vital signs estimate is computed from
 
 # Global Variables
-sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+server = None
+shm_sender = None
 
 # Setup Signal Handler
 def signal_handler(sig, frame):
-    sock.close()
+    if server is not None:
+        server.stop()
+    if shm_sender is not None:
+        shm_sender.close()
     exit(0)
 signal.signal(signal.SIGINT, signal_handler)
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print("Usage: python {command} <port>".format(command=sys.argv[0]))
+        print("Usage: python {command} <port> [chirp|frame|range_doppler|vital_signs] [float32|int16|int16_delta] [background|mti|iir]".format(command=sys.argv[0]))
         exit(0)
 
     PORT = int(sys.argv[1])
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.bind((HOST, PORT))
-    sock.listen(1)
+    STREAM_MODE = sys.argv[2] if len(sys.argv) > 2 else "chirp"
+    ENCODING = sys.argv[3] if len(sys.argv) > 3 else "float32"
+    CLUTTER_REMOVAL = sys.argv[4] if len(sys.argv) > 4 else None
+
+    radar = Radar(
+        stream_mode=STREAM_MODE,
+        encoding=ENCODING,
+        clutter_removal=CLUTTER_REMOVAL,
+        vital_signs_interval=VITAL_SIGNS_INTERVAL,
+        vital_signs_window=VITAL_SIGNS_WINDOW,
+        min_range=0,
+        range_resolution = 0.1
+    )
+
+    # Every client gets the config packet first
+    server = StreamServer(HOST, PORT, QUEUE_SIZE, SLOW_CLIENT_POLICY, COALESCE_BYTES, LATENCY_BUDGET)
+    server.set_handshake(radar.config_packet())
+    # Clients can reconfigure the radar while it streams (see Radar.handle_control_message)
+    server.set_control_handler(radar.handle_control_message)
+    server.start()
     print("Listening on port {port} ...".format(port=PORT))
 
-    client_socket, client_addr = sock.accept()
-    print("Connected by: ", client_addr)
+    sinks = [server]
+    if UDP_TARGET is not None:
+        datagram_sender = DatagramSender(*parse_address(UDP_TARGET))
+        datagram_sender.set_handshake(radar.config_packet())
+        PIPELINE.add_collector(datagram_sender.metrics_samples)
+        sinks.append(datagram_sender)
+        print("Streaming over UDP to {target}".format(target=UDP_TARGET))
+    if SHM_NAME is not None:
+        shm_sender = SharedMemorySender(SHM_NAME)
+        shm_sender.set_handshake(radar.config_packet())
+        PIPELINE.add_collector(shm_sender.metrics_samples)
+        sinks.append(shm_sender)
+        print("Streaming to shared memory {name}".format(name=SHM_NAME))
+    sink = PacketTee(*sinks) if len(sinks) > 1 else server
 
-    radar = Radar(min_range=0, range_resolution = 0.1)
+    PIPELINE.add_collector(radar.metrics_samples)
+    PIPELINE.add_collector(server.metrics_samples)
+    if METRICS_PORT is not None:
+        MetricsHTTPServer(HOST, METRICS_PORT).start()
+    if STATS_INTERVAL is not None:
+        StatsSender(sink, STATS_INTERVAL).start()
 
     try:
-        # Send config data first
-        radar.send_config_packet(client_socket)
-
-        # Commence data stream
-        radar.start_data_stream(client_socket)
+        # Commence data stream, frames are fanned out to all connected clients
+        radar.start_stream(sink)
     except Exception as e:
         print(e)
-        sock.close()
+    finally:
+        # a segment that is not unlinked outlives the process
+        server.stop()
+        if shm_sender is not None:
+            shm_sender.close()
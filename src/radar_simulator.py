@@ -0,0 +1,229 @@
+'''
+    Synthetic FMCW radar with the same interface as ifxRadarSDK.Device and ifxRadarSDK.Frame.
+
+    The IF signal of every target is generated from the device configuration, so range,
+    chirp timing and phase behave like the BGT60 shield:
+
+        f_if  = 2 * S * R(t) / c                (beat frequency, S = chirp slope)
+        phase = 4 * pi * f_c * R(t) / c         (carrier phase, follows chest motion)
+
+    where R(t) is the target range plus breathing and heartbeat displacement sampled at the
+    start time of each chirp. Samples are returned as floats in [0, 1] like the SDK, optionally
+    quantized to the 12 bit ADC grid.
+
+    Usage:
+        device = Device(targets=[Target(1.2)], paced=False)
+        radar = Radar(device=device)
+'''
+import time
+import numpy as np
+from radar_tools import C, FIFO_OVERFLOW_ERROR
+
+ADC_BITS = 12
+
+class Target:
+    def __init__(
+        self,
+        distance,
+        amplitude=0.1,
+        breathing_amplitude=0.004,
+        breathing_rate=0.25,
+        heart_amplitude=0.0003,
+        heart_rate=1.2,
+        angle=0.0,
+    ):
+        '''
+            distance [m], amplitude [ADC full scale], chest displacement amplitudes [m],
+            breathing/heart rates [Hz], angle of arrival [rad]
+        '''
+        self.distance = distance
+        self.amplitude = amplitude
+        self.breathing_amplitude = breathing_amplitude
+        self.breathing_rate = breathing_rate
+        self.heart_amplitude = heart_amplitude
+        self.heart_rate = heart_rate
+        self.angle = angle
+
+    def displacement(self, t):
+        return (
+            self.distance
+            + self.breathing_amplitude * np.sin(2.0 * np.pi * self.breathing_rate * t)
+            + self.heart_amplitude * np.sin(2.0 * np.pi * self.heart_rate * t)
+        )
+
+class Frame():
+    def __init__(self, num_antennas, num_chirps_per_frame, num_samples_per_chirp):
+        self.data = np.zeros((num_antennas, num_chirps_per_frame, num_samples_per_chirp), dtype=np.float32)
+
+    def get_num_rx(self):
+        return self.data.shape[0]
+
+    def get_mat_from_antenna(self, antenna, copy=True):
+        '''
+            If copy is False, the returned matrix is a view that is overwritten by the
+            next Device.get_next_frame call on this frame
+        '''
+        if copy:
+            return self.data[antenna].copy()
+        return self.data[antenna]
+
+class FifoOverflowError(Exception):
+    '''
+        Same error code as ifxRadarSDK.RadarSDKFifoOverflowError
+    '''
+    error = FIFO_OVERFLOW_ERROR
+
+    def __str__(self):
+        return "FIFO overflow"
+
+class Device():
+    def __init__(
+        self,
+        uuid=None,
+        targets=None,
+        noise=0.002,
+        antenna_phase_offsets=(0.0, 0.0, 0.0),
+        antenna_spacing=0.5,
+        paced=True,
+        quantize=True,
+        seed=None,
+        fifo_frames=None,
+    ):
+        '''
+            targets                 list of Target, defaults to one person at 1 m
+            noise                   standard deviation of white noise [ADC full scale]
+            antenna_phase_offsets   fixed phase offset of each physical rx antenna [rad]
+            antenna_spacing         rx antenna spacing [wavelengths], sets the phase
+                                    difference between antennas for a target at an angle
+            paced                   if True, get_next_frame blocks until the next frame is
+                                    due according to the configured frame period, else
+                                    frames are produced as fast as possible
+            quantize                round samples to the 12 bit ADC grid
+            fifo_frames             if set, a paced device overflows like the SDK once the
+                                    consumer falls more than fifo_frames frames behind:
+                                    get_next_frame raises FifoOverflowError until the
+                                    acquisition is restarted with set_config
+        '''
+        self.uuid = (uuid or "00000000000000000000000000000000").replace("-", "")
+        self.targets = [Target(1.0)] if targets is None else list(targets)
+        self.noise = noise
+        self.antenna_phase_offsets = np.asarray(antenna_phase_offsets, dtype=np.float64)
+        self.antenna_spacing = antenna_spacing
+        self.paced = paced
+        self.quantize = quantize
+        self.fifo_frames = fifo_frames
+        self.overflowed = False
+        self.rng = np.random.default_rng(seed)
+        self.config = None
+        self.set_config()
+
+    def set_config(self,
+               num_samples_per_chirp = 64,
+               num_chirps_per_frame = 32,
+               adc_samplerate_Hz = 2000000,
+               frame_period_us = 0,
+               lower_frequency_kHz = 58000000,
+               upper_frequency_kHz = 63000000,
+               bgt_tx_power = 31,
+               rx_antenna_mask = 7,
+               tx_mode = 0,
+               chirp_to_chirp_time_100ps = 1870000,
+               if_gain_dB = 33,
+               frame_end_delay_100ps = 400000000,
+               shape_end_delay_100ps = 1500000):
+        '''
+            Same parameters as ifxRadarSDK.Device.set_config. Restarts the acquisition.
+        '''
+        self.config = dict(
+            num_samples_per_chirp=num_samples_per_chirp,
+            num_chirps_per_frame=num_chirps_per_frame,
+            adc_samplerate_Hz=adc_samplerate_Hz,
+            frame_period_us=frame_period_us,
+            lower_frequency_kHz=lower_frequency_kHz,
+            upper_frequency_kHz=upper_frequency_kHz,
+            bgt_tx_power=bgt_tx_power,
+            rx_antenna_mask=rx_antenna_mask,
+            tx_mode=tx_mode,
+            chirp_to_chirp_time_100ps=chirp_to_chirp_time_100ps,
+            if_gain_dB=if_gain_dB,
+            frame_end_delay_100ps=frame_end_delay_100ps,
+            shape_end_delay_100ps=shape_end_delay_100ps,
+        )
+        self.antenna_indices = [i for i in range(3) if rx_antenna_mask & (1 << i)]
+        if not self.antenna_indices:
+            raise ValueError("rx_antenna_mask enables no antenna")
+
+        lower = 1.0e3 * lower_frequency_kHz
+        upper = 1.0e3 * upper_frequency_kHz
+        chirp_length = num_samples_per_chirp / adc_samplerate_Hz
+        chirp_to_chirp = 1.0e-10 * chirp_to_chirp_time_100ps
+        self.center_frequency = 0.5 * (lower + upper)
+        self.chirp_slope = (upper - lower) / chirp_length
+        self.fast_time = np.arange(num_samples_per_chirp) / adc_samplerate_Hz
+        self.slow_time = np.arange(num_chirps_per_frame) * chirp_to_chirp
+        if frame_period_us:
+            self.frame_period = 1.0e-6 * frame_period_us
+        else:
+            self.frame_period = num_chirps_per_frame * chirp_to_chirp + 1.0e-10 * frame_end_delay_100ps
+
+        self.frame_index = 0
+        self.start_time = time.monotonic()
+        self.overflowed = False
+
+    def create_frame_from_device_handle(self):
+        return Frame(
+            len(self.antenna_indices),
+            self.config["num_chirps_per_frame"],
+            self.config["num_samples_per_chirp"]
+        )
+
+    def get_shield_uuid(self):
+        return self.uuid
+
+    def get_next_frame(self, frame):
+        expected = (
+            len(self.antenna_indices),
+            self.config["num_chirps_per_frame"],
+            self.config["num_samples_per_chirp"]
+        )
+        if frame.data.shape != expected:
+            raise ValueError("Frame dimensions {shape} do not match the device configuration {expected}".format(
+                shape=frame.data.shape, expected=expected))
+
+        frame_time = self.frame_index * self.frame_period
+        if self.overflowed:
+            raise FifoOverflowError()
+        if self.paced:
+            delay = self.start_time + frame_time - time.monotonic()
+            if self.fifo_frames is not None and delay < -self.fifo_frames * self.frame_period:
+                self.overflowed = True
+                raise FifoOverflowError()
+            if delay > 0:
+                time.sleep(delay)
+        self.frame_index += 1
+
+        self.synthesize(frame_time, frame.data)
+
+    def synthesize(self, frame_time, out):
+        signal = np.zeros(out.shape, dtype=np.float64)
+        antenna_offsets = self.antenna_phase_offsets[self.antenna_indices]
+        antenna_positions = np.asarray(self.antenna_indices, dtype=np.float64)
+        for target in self.targets:
+            distance = target.displacement(frame_time + self.slow_time)[:, None]
+            beat_frequency = 2.0 * self.chirp_slope * distance / C
+            carrier_phase = 4.0 * np.pi * self.center_frequency * distance / C
+            antenna_phase = antenna_offsets + 2.0 * np.pi * self.antenna_spacing * antenna_positions * np.sin(target.angle)
+            signal += target.amplitude * np.cos(
+                2.0 * np.pi * beat_frequency * self.fast_time
+                + carrier_phase
+                + antenna_phase[:, None, None]
+            )
+
+        signal += 0.5
+        if self.noise:
+            signal += self.rng.normal(0.0, self.noise, size=signal.shape)
+        np.clip(signal, 0.0, 1.0, out=signal)
+        if self.quantize:
+            levels = (1 << ADC_BITS) - 1
+            signal = np.round(signal * levels) / levels
+        out[...] = signal
@@ -0,0 +1,246 @@
+'''
+    Runs every attached radar in its own worker process and serves all of them on one port.
+
+    The supervisor lists the attached shields (ifxRadarSDK.get_device_list) and starts one
+    worker process per device, each pinned to its own core if the host has enough. A worker
+    opens its device by shield uuid and runs the complete acquisition and DSP chain of its
+    stream mode with its own interpreter, so devices do not compete for one GIL. Packets come
+    back to the supervisor over a pipe with the device id set in the packet header and are
+    fanned out to the clients by a StreamServer.
+
+    Every client first gets a config packet listing the devices:
+
+        {"packet_type": "config", "stream": {"mode": "multi_device"}, "devices": [{"device": 0, "uuid": ..., "port": ...}, ...]}
+
+    followed by the config packet of every device (with an additional "device" entry) and
+    then the binary packets of all devices interleaved. Timestamps of all devices are on the
+    same monotonic clock.
+
+    Usage: python src/radar_supervisor.py <port> [mode] [encoding] [simulated devices]
+'''
+from multiprocessing import connection as mp_connection
+import multiprocessing
+import os
+import signal
+import sys
+import timestamps
+from radar import Radar
+from radar_protocol import pack_json_packet, set_device, wire_format
+from stream_server import StreamServer
+
+# Constants
+HOST = "192.168.50.97" # Change this to raspberry Pi IP address (type "hostname -I" in rp terminal)
+QUEUE_SIZE = 64 # packets queued per client before the slow client policy applies
+SLOW_CLIENT_POLICY = "drop" # "drop" or "disconnect"
+COALESCE_BYTES = 65536 # packets waiting for a client are sent together in writes of up to this size
+LATENCY_BUDGET = 0.0 # [s] time a packet may wait for more packets to fill a write, 0 sends at once with TCP_NODELAY
+RADAR_CONFIG = dict(min_range=0, range_resolution=0.1)
+VITAL_SIGNS_INTERVAL = 1.0 # [s] between two vital signs estimates in vital_signs mode
+VITAL_SIGNS_WINDOW = 20.0 # [s] of phase history each vital signs estimate is computed from
+
+class PipeSink:
+    '''
+        Packet sink of a worker, tags every packet with the device id
+    '''
+    def __init__(self, connection, device_id):
+        self.connection = connection
+        self.device_id = device_id
+
+    def write_packet(self, header, payload):
+        packet = set_device(header, self.device_id)
+        packet += payload
+        self.connection.send_bytes(packet)
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def pin_to_core(core):
+    if core is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {core})
+
+def core_assignment(num_devices):
+    '''
+        Returns (supervisor core, [worker cores]). The supervisor keeps the first core to
+        itself if there are more cores than devices. None means not pinned.
+    '''
+    cores = available_cores()
+    if len(cores) < 2:
+        return None, [None] * num_devices
+    if len(cores) > num_devices:
+        return cores[0], [cores[1 + i] for i in range(num_devices)]
+    return None, [cores[i % len(cores)] for i in range(num_devices)]
+
+def find_devices(simulated=0):
+    '''
+        Returns (port, uuid) of the attached devices, or of simulated devices
+    '''
+    if simulated:
+        return [(None, "{0:032x}".format(i + 1)) for i in range(simulated)]
+    from ifxRadarSDK import get_device_list
+    return get_device_list()
+
+def open_device(port, uuid, simulated):
+    if simulated:
+        from radar_simulator import Device
+        return Device(uuid)
+    from ifxRadarSDK import Device
+    if uuid is not None:
+        return Device(uuid)
+    return Device(port=port)
+
+def run_worker(device_id, port, uuid, core, connection, stream_mode, encoding, simulated):
+    '''
+        Worker process: streams one device into connection. The first message is the
+        config of the device, all following messages are binary packets.
+    '''
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # the supervisor stops the workers
+    pin_to_core(core)
+    radar = Radar(
+        stream_mode=stream_mode,
+        encoding=encoding,
+        device=open_device(port, uuid, simulated),
+        vital_signs_interval=VITAL_SIGNS_INTERVAL,
+        vital_signs_window=VITAL_SIGNS_WINDOW,
+        **RADAR_CONFIG
+    )
+    config = radar.config_message()
+    config["device"] = device_id
+    connection.send_bytes(pack_json_packet(config))
+    try:
+        radar.start_stream(PipeSink(connection, device_id))
+    except (BrokenPipeError, EOFError):
+        pass
+
+class Supervisor:
+    def __init__(self, devices, stream_mode="chirp", encoding="float32", simulated=False):
+        self.devices = devices
+        self.stream_mode = stream_mode
+        self.encoding = encoding
+        self.simulated = simulated
+        self.workers = {}
+        self.connections = {}
+        self.configs = {}
+        self.packets = {}
+        self.running = False
+
+    def start(self):
+        '''
+            Starts the workers and waits for the config of every device
+        '''
+        supervisor_core, worker_cores = core_assignment(len(self.devices))
+        pin_to_core(supervisor_core)
+        # spawn, so no worker inherits SDK or USB state of the supervisor
+        context = multiprocessing.get_context("spawn")
+        for device_id, (port, uuid) in enumerate(self.devices):
+            receiver, sender = context.Pipe(duplex=False)
+            worker = context.Process(
+                target=run_worker,
+                args=(device_id, port, uuid, worker_cores[device_id], sender, self.stream_mode, self.encoding, self.simulated),
+                daemon=True
+            )
+            worker.start()
+            sender.close()
+            self.workers[device_id] = worker
+            self.connections[device_id] = receiver
+            self.packets[device_id] = 0
+        for device_id, receiver in list(self.connections.items()):
+            try:
+                self.configs[device_id] = receiver.recv_bytes()
+            except EOFError:
+                self.worker_exited(device_id)
+        self.running = True
+
+    def handshake(self):
+        devices = [
+            {"device": device_id, "port": port, "uuid": uuid}
+            for device_id, (port, uuid) in enumerate(self.devices)
+            if device_id in self.configs
+        ]
+        packet = pack_json_packet({
+            "packet_type": "config",
+            "wire_format": wire_format(),
+            "clock": timestamps.clock_info(),
+            "stream": {"mode": "multi_device"},
+            "devices": devices,
+        })
+        return packet + b"".join(self.configs[device["device"]] for device in devices)
+
+    def forward(self, sink):
+        '''
+            Passes the packets of all workers to sink.sendall until every worker has exited
+        '''
+        devices = {receiver: device_id for device_id, receiver in self.connections.items()}
+        while self.running and devices:
+            for receiver in mp_connection.wait(list(devices)):
+                try:
+                    packet = receiver.recv_bytes()
+                except EOFError:
+                    self.worker_exited(devices.pop(receiver))
+                    continue
+                self.packets[devices[receiver]] += 1
+                sink.sendall(packet)
+
+    def worker_exited(self, device_id):
+        worker = self.workers[device_id]
+        worker.join()
+        self.connections.pop(device_id).close()
+        print("Worker of device {device} exited with code {code}".format(device=device_id, code=worker.exitcode))
+
+    def stop(self):
+        self.running = False
+        for worker in self.workers.values():
+            if worker.is_alive():
+                worker.terminate()
+        for worker in self.workers.values():
+            worker.join()
+
+    def stats(self):
+        return {
+            "devices": [
+                {"device": device_id, "alive": worker.is_alive(), "packets": self.packets[device_id]}
+                for device_id, worker in self.workers.items()
+            ]
+        }
+
+# Global Variables
+server = None
+supervisor = None
+
+# Setup Signal Handler
+def signal_handler(sig, frame):
+    if supervisor is not None:
+        supervisor.stop()
+    if server is not None:
+        server.stop()
+    exit(0)
+
+if __name__ == "__main__":
+    signal.signal(signal.SIGINT, signal_handler)
+    if len(sys.argv) < 2:
+        print("Usage: python {command} <port> [chirp|frame|range_doppler|vital_signs] [float32|int16|int16_delta] [simulated devices]".format(command=sys.argv[0]))
+        exit(0)
+
+    PORT = int(sys.argv[1])
+    STREAM_MODE = sys.argv[2] if len(sys.argv) > 2 else "chirp"
+    ENCODING = sys.argv[3] if len(sys.argv) > 3 else "float32"
+    SIMULATED = int(sys.argv[4]) if len(sys.argv) > 4 else 0
+
+    devices = find_devices(SIMULATED)
+    if not devices:
+        print("No radar device found")
+        exit(1)
+    for device_id, (port, uuid) in enumerate(devices):
+        print("Device {device}: uuid {uuid} on {port}".format(device=device_id, uuid=uuid, port=port))
+
+    supervisor = Supervisor(devices, STREAM_MODE, ENCODING, SIMULATED > 0)
+    supervisor.start()
+
+    server = StreamServer(HOST, PORT, QUEUE_SIZE, SLOW_CLIENT_POLICY, COALESCE_BYTES, LATENCY_BUDGET)
+    server.set_handshake(supervisor.handshake())
+    server.start()
+    print("Listening on port {port} ...".format(port=PORT))
+
+    supervisor.forward(server)
+    server.stop()
@@ -1,4 +1,5 @@
 C = 2.99792458e8
+FIFO_OVERFLOW_ERROR = 0x1100E # error code of ifxRadarSDK.RadarSDKFifoOverflowError
 
 def highest_power_of_two(val):
     '''
@@ -0,0 +1,75 @@
+'''
+    Range-Doppler map engine.
+
+    Each (rx, chirps, samples) frame cube goes through the range FFT of the
+    DigitalSignalProcessor, then a windowed FFT across chirps (slow time) gives the Doppler
+    spectrum of every range bin. Magnitudes are fftshifted so zero velocity is in the middle
+    and averaged over antennas (non-coherent integration) into one (velocity, range) map.
+
+    The velocity axis follows from the chirp timing: the Doppler bin spacing is
+    lambda / (2 * num_chirps * T_c) where T_c is the chirp to chirp time, which spans
+    -max_speed ... max_speed by construction of RadarMetrics.chirp_to_chirp_time_100ps.
+'''
+from scipy.fft import fft, fftshift
+import numpy as np
+from dsp import DigitalSignalProcessor
+from dsp_plan import doppler_plan
+
+class RangeDopplerProcessor:
+    def __init__(self, radar_metrics, crop=True, doppler_window="hann", integrate_antennas=True, dsp=None, clutter=None):
+        '''
+            crop keeps only range bins in [min_range, max_range] and velocities within
+            +-max_speed of radar_metrics. integrate_antennas averages the antenna maps,
+            otherwise one map per antenna is returned. clutter is an optional
+            clutter.ClutterFilter applied to the range spectrum before the Doppler FFT.
+        '''
+        self.radar_metrics = radar_metrics
+        self.dsp = dsp or DigitalSignalProcessor(radar_metrics)
+        self.clutter = clutter
+        self.integrate_antennas = integrate_antennas
+        self.plan = doppler_plan(radar_metrics, doppler_window)
+        self.num_chirps = self.plan.num_chirps
+        self.doppler_window = self.plan.doppler_window
+
+        if crop:
+            self.range_slice = self.dsp.plan.range_slice
+            self.velocity_slice = self.plan.velocity_slice
+        else:
+            self.range_slice = slice(None)
+            self.velocity_slice = slice(None)
+        self.range_axis = self.dsp.range_axis()[self.range_slice]
+        self.velocity_axis = self.plan.velocity_axis[self.velocity_slice]
+
+        self.range_spectrum = None
+        self.magnitude = None
+
+    @property
+    def map_shape(self):
+        return (len(self.velocity_axis), len(self.range_axis))
+
+    def process(self, frame, out=None):
+        '''
+            frame is a (rx, chirps, samples) cube or a single (chirps, samples) matrix.
+            Returns the float32 (velocity, range) magnitude map, or (rx, velocity, range) if
+            antennas are not integrated, written into out if given.
+        '''
+        spectrum_shape = frame.shape[:-1] + (self.dsp.num_bins, )
+        if self.range_spectrum is None or self.range_spectrum.shape != spectrum_shape:
+            self.range_spectrum = np.empty(spectrum_shape, dtype=np.complex64)
+            self.magnitude = np.empty(spectrum_shape, dtype=np.float32)
+
+        range_spectrum = self.dsp.range_fft(frame, out=self.range_spectrum)
+        if self.clutter is not None:
+            self.clutter.process(range_spectrum)
+        np.multiply(range_spectrum, self.doppler_window, out=range_spectrum)
+        doppler = fft(range_spectrum, axis=-2, overwrite_x=True)
+        np.abs(doppler, out=self.magnitude)
+
+        shifted = fftshift(self.magnitude, axes=-2)
+        cropped = shifted[..., self.velocity_slice, self.range_slice]
+        if cropped.ndim == 3 and self.integrate_antennas:
+            return np.mean(cropped, axis=0, out=out)
+        if out is None:
+            return np.ascontiguousarray(cropped)
+        out[...] = cropped
+        return out
@@ -0,0 +1,310 @@
+'''
+    Client side of the radar stream.
+
+    PacketParser is an incremental framing parser over one preallocated receive buffer: the
+    socket reads straight into it with recv_into, and complete packets are decoded in place.
+    Raw float32 sample payloads come out as numpy views on that buffer, without a
+    copy, so a packet's data is only valid until the next packet is requested (copy it to
+    keep it). int16 payloads are dequantized into new arrays.
+
+    Packets are returned as
+        ConfigPacket    the config handshake or a config update, with the RadarMetrics
+                        equivalent to the sender's configuration and the stream config
+        DataPacket      a PacketHeader and the decoded samples
+        JsonPacket      any other JSON packet (control replies, stats)
+
+    Blocking:
+        with Receiver.connect(host, port) as receiver:
+            for packet in receiver:
+                ...
+
+    asyncio:
+        receiver = await AsyncReceiver.connect(host, port)
+        async for packet in receiver:
+            ...
+
+    UDP (unicast or multicast, see udp_transport), packets may be lost:
+        with UdpReceiver(port, group) as receiver:
+            for packet in receiver:
+                ...
+'''
+from collections import namedtuple
+import asyncio
+import json
+import socket
+from radar_config import RadarMetrics
+from udp_transport import MAX_DATAGRAM, Reassembler
+from radar_protocol import (
+    HEADER_LENGTH, HEADER_SIZE, MAGIC, ProtocolError, decode_payload, pack_json_packet, unpack_header
+)
+
+BUFFER_SIZE = 1 << 20
+
+ConfigPacket = namedtuple('ConfigPacket', ['message', 'metrics', 'stream'])
+DataPacket = namedtuple('DataPacket', ['header', 'data'])
+JsonPacket = namedtuple('JsonPacket', ['message'])
+
+def metrics_from_config(message):
+    '''
+        RadarMetrics equal to the sender's, from a config message. Senders predating the
+        "parameters" entry only give the "data" values: the sent maximum range and speed
+        are the actual ones, which give the same sample and chirp counts, but the chirp to
+        chirp time may differ.
+    '''
+    if "parameters" in message:
+        return RadarMetrics(**message["parameters"])
+    data = message["data"]
+    return RadarMetrics(
+        range_resolution=data["range_resolution"],
+        max_range=data["max_range"],
+        min_range=data["min_range"],
+        speed_resolution=data["speed_resolution"],
+        max_speed=data["max_speed"],
+        frame_rate=data["frame_rate"],
+        adc_sample_rate_hz=data["adc_sample_rate_hz"],
+        rx_antenna_number=data["rx_antenna_number"],
+        center_frequency=data["center_frequency"],
+    )
+
+def json_packet(message):
+    if message.get("packet_type") != "config":
+        return JsonPacket(message)
+    metrics = metrics_from_config(message) if "data" in message else None
+    return ConfigPacket(message, metrics, message.get("stream"))
+
+def packet_length(view):
+    '''
+        Length of the packet at the start of view, or the header size if view is too short
+        to tell
+    '''
+    prefix = view[:HEADER_LENGTH]
+    if prefix == MAGIC:
+        if len(view) < HEADER_SIZE:
+            return HEADER_SIZE
+        return HEADER_SIZE + unpack_header(view[:HEADER_SIZE]).payload_length
+    length = bytes(prefix)
+    if not length.isdigit():
+        raise ProtocolError("Bad packet start: {prefix}".format(prefix=length))
+    return HEADER_LENGTH + int(length)
+
+def decode_packet(view):
+    '''
+        Packet of one complete packet in view, raw samples are a view on it
+    '''
+    if view[:HEADER_LENGTH] == MAGIC:
+        header = unpack_header(view[:HEADER_SIZE])
+        return DataPacket(header, decode_payload(header, view[HEADER_SIZE:HEADER_SIZE + header.payload_length]))
+    return json_packet(json.loads(bytes(view[HEADER_LENGTH:]).decode('utf-8')))
+
+class PacketParser:
+    def __init__(self, buffer_size=BUFFER_SIZE):
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0 # first byte not parsed yet
+        self.end = 0 # end of the received bytes
+        self.needed = 0 # size of the incomplete packet at start, if known
+
+    def writable(self):
+        '''
+            Free part of the buffer to receive into, call advance() with the number of bytes
+            received. Invalidates the data of the packets returned so far.
+        '''
+        if self.start:
+            pending = self.end - self.start
+            self.buffer[:pending] = self.view[self.start:self.end]
+            self.start, self.end = 0, pending
+        if max(self.needed, self.end + 1) > len(self.buffer):
+            # the old buffer stays alive as long as views on it exist
+            size = max(self.needed, 2 * len(self.buffer))
+            buffer = bytearray(size)
+            buffer[:self.end] = self.view[:self.end]
+            self.buffer, self.view = buffer, memoryview(buffer)
+        return self.view[self.end:]
+
+    def advance(self, received):
+        self.end += received
+
+    def next_packet(self):
+        '''
+            Returns the next complete packet, or None if more data is needed
+        '''
+        available = self.end - self.start
+        if available < HEADER_LENGTH:
+            return None
+        start = self.start
+        self.needed = packet_length(self.view[start:self.end])
+        if available < self.needed:
+            return None
+        self.start += self.needed
+        self.needed = 0
+        return decode_packet(self.view[start:self.start])
+
+class Receiver:
+    '''
+        Blocking receiver, iterating yields packets until the sender closes the connection.
+        The last config is kept in config / metrics.
+    '''
+    def __init__(self, sock, buffer_size=BUFFER_SIZE):
+        self.socket = sock
+        self.parser = PacketParser(buffer_size)
+        self.config = None
+        self.metrics = None
+
+    @classmethod
+    def connect(cls, host, port, buffer_size=BUFFER_SIZE):
+        return cls(socket.create_connection((host, port)), buffer_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        while True:
+            packet = self.receive()
+            if packet is None:
+                return
+            yield packet
+
+    def receive(self):
+        '''
+            Returns the next packet, or None once the connection is closed
+        '''
+        while True:
+            packet = self.parser.next_packet()
+            if packet is not None:
+                if isinstance(packet, ConfigPacket):
+                    self.config, self.metrics = packet, packet.metrics
+                return packet
+            received = self.socket.recv_into(self.parser.writable())
+            if not received:
+                return None
+            self.parser.advance(received)
+
+    def send_control(self, message):
+        '''
+            Sends a control packet, e.g. {"command": "configure", "mode": "frame"}. The reply
+            arrives as a JsonPacket in the stream.
+        '''
+        self.socket.sendall(pack_json_packet(message))
+
+    def close(self):
+        self.socket.close()
+
+class AsyncReceiver:
+    '''
+        asyncio receiver, "async for" yields packets until the sender closes the connection
+    '''
+    def __init__(self, sock, buffer_size=BUFFER_SIZE):
+        sock.setblocking(False)
+        self.socket = sock
+        self.parser = PacketParser(buffer_size)
+        self.config = None
+        self.metrics = None
+
+    @classmethod
+    async def connect(cls, host, port, buffer_size=BUFFER_SIZE):
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        family, type_, proto, _, address = infos[0]
+        sock = socket.socket(family, type_, proto)
+        sock.setblocking(False)
+        try:
+            await loop.sock_connect(sock, address)
+        except Exception:
+            sock.close()
+            raise
+        return cls(sock, buffer_size)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        packet = await self.receive()
+        if packet is None:
+            raise StopAsyncIteration
+        return packet
+
+    async def receive(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            packet = self.parser.next_packet()
+            if packet is not None:
+                if isinstance(packet, ConfigPacket):
+                    self.config, self.metrics = packet, packet.metrics
+                return packet
+            received = await loop.sock_recv_into(self.socket, self.parser.writable())
+            if not received:
+                return None
+            self.parser.advance(received)
+
+    async def send_control(self, message):
+        await asyncio.get_running_loop().sock_sendall(self.socket, pack_json_packet(message))
+
+    def close(self):
+        self.socket.close()
+
+class UdpReceiver:
+    '''
+        Receiver of a udp_transport.DatagramSender stream, iterating yields packets until
+        closed. group is the multicast group to join, None for unicast. Lost packets are
+        skipped, reassembler.stats() counts them and last_gap is the number of packets lost
+        right before the current one. The sender repeats the config, so packets before the
+        first config can be skipped with wait_for_config.
+    '''
+    def __init__(self, port, group=None, interface="0.0.0.0", max_datagram=MAX_DATAGRAM, max_pending=16):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((group if group is not None else interface, port))
+        if group is not None:
+            membership = socket.inet_aton(group) + socket.inet_aton(interface)
+            self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        self.datagram = bytearray(max(max_datagram, 1 << 16))
+        self.reassembler = Reassembler(max_pending)
+        self.config = None
+        self.metrics = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        while True:
+            try:
+                packet = self.receive()
+            except OSError:
+                return # closed
+            yield packet
+
+    @property
+    def last_gap(self):
+        return self.reassembler.last_gap
+
+    def receive(self):
+        '''
+            Returns the next complete packet
+        '''
+        view = memoryview(self.datagram)
+        while True:
+            received = self.socket.recv_into(self.datagram)
+            buffer = self.reassembler.add(view[:received])
+            if buffer is None:
+                continue
+            packet = decode_packet(memoryview(buffer))
+            if isinstance(packet, ConfigPacket):
+                # the sender repeats it, only updates are passed on
+                if self.config is not None and packet.message == self.config.message:
+                    continue
+                self.config, self.metrics = packet, packet.metrics
+            return packet
+
+    def wait_for_config(self):
+        while self.config is None:
+            self.receive()
+        return self.config
+
+    def close(self):
+        self.socket.close()
@@ -0,0 +1,326 @@
+'''
+    Shared memory transport for consumers on the same host.
+
+    SharedMemorySender is a packet sink (like StreamServer) that writes every packet of the
+    stream, binary or JSON, into a ring of fixed size slots in a multiprocessing.shared_memory
+    segment. The packet bytes are those of the TCP stream: header and payload are copied
+    into the slot once and nothing is serialized. Any number of SharedMemoryReceiver
+    processes read the packets in place: raw float32 samples are numpy views on the shared
+    memory.
+
+    Layout of the segment:
+
+        control     CONTROL_STRUCT  magic, version, slot count, slot size, write sequence,
+                                    config sequence, config length
+        config      CONFIG_SIZE     the current config packet (handshake)
+        slots       slot count * (SLOT_STRUCT + slot size)
+                                    sequence, packet length, packet bytes
+
+    Packet n (counted from 1) goes to slot n % slot count. The sender sets the slot
+    sequence to 0 while writing it and to n afterwards, then publishes n as the write
+    sequence. The single producer never waits for consumers: a consumer more than a ring
+    behind has lost the overwritten packets and continues with the newest one. In-place data
+    is only valid until the sender wraps around to its slot; still_valid() tells whether the
+    last packet was overwritten meanwhile.
+
+    Consumers subscribe to wakeups over a Unix datagram socket next to the segment name and
+    block on it instead of polling: the sender sends every subscriber a datagram after
+    each packet, and drops subscribers that are gone.
+
+    A segment of the same name left behind by a sender that crashed or was killed is
+    unlinked and created anew when the next sender starts.
+'''
+from multiprocessing import resource_tracker, shared_memory
+from threading import Lock
+import os
+import socket
+import struct
+import tempfile
+import timestamps
+from receiver import ConfigPacket, decode_packet
+
+SHM_MAGIC = b"RTVS"
+SHM_VERSION = 1
+CONTROL_STRUCT = struct.Struct('<4sIIIQQI4x')
+SLOT_STRUCT = struct.Struct('<QI4x')
+CONFIG_SIZE = 1 << 16
+SLOT_COUNT = 16
+SLOT_SIZE = 1 << 20 # [bytes] largest packet, header included
+WRITE_SEQUENCE_OFFSET = 16
+CONFIG_SEQUENCE_OFFSET = 24
+
+def notification_path(name):
+    return os.path.join(tempfile.gettempdir(), "{name}.sock".format(name=name))
+
+def attach(name):
+    '''
+        Opens an existing segment without handing it to the resource tracker of this
+        process, which would otherwise unlink it when the consumer exits
+    '''
+    memory = shared_memory.SharedMemory(name)
+    try:
+        resource_tracker.unregister(memory._name, "shared_memory")
+    except Exception:
+        pass
+    return memory
+
+def create_segment(name, size):
+    '''
+        Creates the segment, replacing one left behind by a sender that crashed or was killed
+    '''
+    try:
+        return shared_memory.SharedMemory(name, create=True, size=size)
+    except FileExistsError:
+        stale = shared_memory.SharedMemory(name)
+        stale.close()
+        stale.unlink()
+        print("Replaced the stale shared memory segment {name}".format(name=name))
+        return shared_memory.SharedMemory(name, create=True, size=size)
+
+class SharedMemorySender:
+    '''
+        Single producer of the ring, safe to call from any thread of the producing process
+    '''
+    def __init__(self, name, slot_count=SLOT_COUNT, slot_size=SLOT_SIZE):
+        self.name = name
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        self.slot_stride = SLOT_STRUCT.size + slot_size
+        self.slots_offset = CONTROL_STRUCT.size + CONFIG_SIZE
+        size = self.slots_offset + slot_count * self.slot_stride
+        self.memory = create_segment(name, size)
+        self.buffer = self.memory.buf
+        CONTROL_STRUCT.pack_into(self.buffer, 0, SHM_MAGIC, SHM_VERSION, slot_count, slot_size, 0, 0, 0)
+        self.write_sequence = 0
+        self.config_sequence = 0
+        self.lock = Lock()
+        self.packets = 0
+        self.oversized = 0
+        self.closed = False
+
+        self.notification_path = notification_path(name)
+        if os.path.exists(self.notification_path):
+            os.unlink(self.notification_path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.bind(self.notification_path)
+        self.socket.setblocking(False)
+        self.subscribers = set()
+
+    # sink interface, like StreamServer
+
+    def set_handshake(self, packet):
+        '''
+            Config packet every consumer gets first
+        '''
+        packet = bytes(packet)
+        if len(packet) > CONFIG_SIZE:
+            raise ValueError("Config packet of {length} bytes does not fit".format(length=len(packet)))
+        with self.lock:
+            self.write_config(packet)
+
+    def write_config(self, packet):
+        # odd while writing, readers retry
+        self.config_sequence += 1
+        struct.pack_into('<Q', self.buffer, CONFIG_SEQUENCE_OFFSET, self.config_sequence)
+        self.buffer[CONTROL_STRUCT.size:CONTROL_STRUCT.size + len(packet)] = packet
+        self.config_sequence += 1
+        struct.pack_into('<QI', self.buffer, CONFIG_SEQUENCE_OFFSET, self.config_sequence, len(packet))
+
+    def update_handshake(self, packet):
+        self.set_handshake(packet)
+        self.sendall(packet)
+
+    def sendall(self, packet):
+        self.write((packet, ))
+
+    def write_packet(self, header, payload):
+        self.write((header, payload))
+
+    def write(self, buffers):
+        buffers = [memoryview(buffer).cast("B") for buffer in buffers]
+        length = sum(len(buffer) for buffer in buffers)
+        if length > self.slot_size:
+            self.oversized += 1
+            if self.oversized == 1:
+                print("Packet of {length} bytes does not fit a {size} byte slot, dropped".format(length=length, size=self.slot_size))
+            return
+        with self.lock:
+            self.write_slot(buffers, length)
+        self.notify()
+
+    def write_slot(self, buffers, length):
+        sequence = self.write_sequence + 1
+        offset = self.slots_offset + (sequence % self.slot_count) * self.slot_stride
+        SLOT_STRUCT.pack_into(self.buffer, offset, 0, length)
+        position = offset + SLOT_STRUCT.size
+        for buffer in buffers:
+            self.buffer[position:position + len(buffer)] = buffer
+            position += len(buffer)
+        SLOT_STRUCT.pack_into(self.buffer, offset, sequence, length)
+        struct.pack_into('<Q', self.buffer, WRITE_SEQUENCE_OFFSET, sequence)
+        self.write_sequence = sequence
+        self.packets += 1
+
+    def notify(self):
+        while True:
+            try:
+                _, address = self.socket.recvfrom(16)
+            except (BlockingIOError, OSError):
+                break
+            if address:
+                self.subscribers.add(address)
+        for address in list(self.subscribers):
+            try:
+                self.socket.sendto(b"\x01", address)
+            except BlockingIOError:
+                pass # a wakeup is pending already
+            except OSError:
+                self.subscribers.discard(address)
+
+    def close(self):
+        '''
+            Removes the segment, can be called more than once
+        '''
+        if self.closed:
+            return
+        self.closed = True
+        self.socket.close()
+        if os.path.exists(self.notification_path):
+            os.unlink(self.notification_path)
+        del self.buffer
+        self.memory.close()
+        self.memory.unlink()
+
+    def metrics_samples(self):
+        '''
+            Gauge samples for telemetry.PIPELINE.add_collector
+        '''
+        labels = {"name": self.name}
+        return [
+            ("shm_packets", labels, self.packets),
+            ("shm_subscribers", labels, len(self.subscribers)),
+            ("shm_oversized_packets", labels, self.oversized),
+        ]
+
+class SharedMemoryReceiver:
+    '''
+        Consumer of a SharedMemorySender ring. Iterating yields the config packet and then
+        every packet from the newest one on, as receiver.ConfigPacket / DataPacket /
+        JsonPacket with the data in place. Drop the packets before close().
+    '''
+    def __init__(self, name):
+        self.memory = attach(name)
+        self.buffer = self.memory.buf
+        magic, version, self.slot_count, self.slot_size, write_sequence, _, _ = CONTROL_STRUCT.unpack_from(self.buffer)
+        if magic != SHM_MAGIC or version != SHM_VERSION:
+            raise ValueError("{name} is not a version {version} radar ring".format(name=name, version=SHM_VERSION))
+        self.slot_stride = SLOT_STRUCT.size + self.slot_size
+        self.slots_offset = CONTROL_STRUCT.size + CONFIG_SIZE
+
+        # subscribe before looking at the ring, so no wakeup is missed
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.path = os.path.join(tempfile.gettempdir(), "{name}-{pid}-{id:x}.sock".format(name=name, pid=os.getpid(), id=id(self)))
+        self.socket.bind(self.path)
+        self.socket.sendto(b"subscribe", notification_path(name))
+
+        self.next_sequence = max(write_sequence, 1)
+        self.current = None
+        self.lost = 0
+        self.config = None
+        self.metrics = None
+        self.pending_config = self.read_config()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        while True:
+            yield self.receive()
+
+    def read_config(self):
+        while True:
+            sequence, length = struct.unpack_from('<QI', self.buffer, CONFIG_SEQUENCE_OFFSET)
+            if sequence == 0:
+                return None
+            if sequence % 2:
+                continue
+            packet = bytes(self.buffer[CONTROL_STRUCT.size:CONTROL_STRUCT.size + length])
+            if struct.unpack_from('<Q', self.buffer, CONFIG_SEQUENCE_OFFSET)[0] == sequence:
+                return decode_packet(memoryview(packet))
+
+    def receive(self, timeout=None):
+        '''
+            Returns the next packet, or None after timeout [s] without one
+        '''
+        if self.pending_config is not None:
+            packet, self.pending_config = self.pending_config, None
+            return self.accept(packet)
+        deadline = None if timeout is None else timestamps.now() + timeout
+        while True:
+            packet = self.next_packet()
+            if packet is not None:
+                return self.accept(packet)
+            remaining = None if deadline is None else deadline - timestamps.now()
+            if remaining is not None and remaining <= 0:
+                return None
+            self.wait(remaining)
+
+    def accept(self, packet):
+        if isinstance(packet, ConfigPacket):
+            self.config, self.metrics = packet, packet.metrics
+        return packet
+
+    def next_packet(self):
+        write_sequence = struct.unpack_from('<Q', self.buffer, WRITE_SEQUENCE_OFFSET)[0]
+        while self.next_sequence <= write_sequence:
+            if write_sequence - self.next_sequence >= self.slot_count - 1:
+                # lapped, the older packets are overwritten or about to be
+                self.lost += write_sequence - self.next_sequence
+                self.next_sequence = write_sequence
+            sequence = self.next_sequence
+            self.next_sequence += 1
+            offset = self.slots_offset + (sequence % self.slot_count) * self.slot_stride
+            slot_sequence, length = SLOT_STRUCT.unpack_from(self.buffer, offset)
+            if slot_sequence != sequence:
+                self.lost += 1
+                continue
+            start = offset + SLOT_STRUCT.size
+            self.current = (offset, sequence)
+            return decode_packet(self.buffer[start:start + length])
+        return None
+
+    def still_valid(self):
+        '''
+            True if the data of the last packet has not been overwritten yet
+        '''
+        if self.current is None:
+            return False
+        offset, sequence = self.current
+        return SLOT_STRUCT.unpack_from(self.buffer, offset)[0] == sequence
+
+    def wait(self, timeout):
+        self.socket.settimeout(timeout)
+        try:
+            self.socket.recv(16)
+        except socket.timeout:
+            return
+        # coalesce the wakeups that piled up
+        self.socket.setblocking(False)
+        try:
+            while True:
+                self.socket.recv(16)
+        except (BlockingIOError, OSError):
+            pass
+
+    def stats(self):
+        return {"next_sequence": self.next_sequence, "lost": self.lost}
+
+    def close(self):
+        self.socket.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        del self.buffer
+        self.memory.close()
@@ -1,12 +1,14 @@
 import cv2
-import time
 import signal
 import sys
-import socket
+import numpy as np
+from camera_capture import CameraCapture
+from radar_protocol import PACKET_SPEED, send_packet, speed_config_packet
+from stream_server import StreamServer
+from udp_transport import DatagramSender, PacketTee, parse_address
 
 # Constants
 HOST = "192.168.50.97" # Change this to raspberry Pi IP address (type "hostname -I" in rp terminal)
-HEADER_LENGTH = 4
 BELT_LENGTH = 2.481 # [m]
 FRAME_WIDTH = 640
 FRAME_HEIGHT = 480
@@ -14,34 +16,67 @@ FPS = 30
 # threshold for greyscale value of pixel, 0 being black 255 being full white
 THRESHOLD = 30 # might need to decrease this in a darker environement
 BINARY_THRESHOLD = 50
+# only this part of the frame is searched for the marker, (x, y, width, height) or None for the whole frame
+ROI = None
+# scan a single row of the ROI instead of the whole ROI, or None
+LINE_SCAN_ROW = None
+# take every DOWNSCALE-th pixel of the ROI in both directions
+DOWNSCALE = 1
+QUEUE_SIZE = 64 # speed packets queued per client before the slow client policy applies
+SLOW_CLIENT_POLICY = "drop" # "drop" or "disconnect"
+COALESCE_BYTES = 65536 # packets waiting for a client are sent together in writes of up to this size
+LATENCY_BUDGET = 0.0 # [s] time a packet may wait for more packets to fill a write, 0 sends at once with TCP_NODELAY
+UDP_TARGET = None # "host:port" (unicast, or a multicast group like "239.0.0.1:5005") to also stream over UDP for live display, None to disable
 
 # Global Variables
-sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-cap = cv2.VideoCapture(0)
-prev_time = time.time()
+server = None
+camera = None
+prev_time = None
 is_marker = False
+sequence = 0
 
 # Helper Functions
-def send_speed(speed, client_socket):
-    speed = str(round(speed, 2))
+def send_speed(speed, client_socket, timestamp):
+    '''
+        Sends the speed as a binary PACKET_SPEED packet stamped with the capture time of
+        the marker, on the same clock as the radar frames
+    '''
+    global sequence
     try:
-        packet_len = str(len(speed)).zfill(HEADER_LENGTH)
-        msg = bytes(packet_len + speed, 'utf-8')
-        client_socket.sendall(msg)
-        print(msg)
+        send_packet(client_socket, PACKET_SPEED, np.array([speed], dtype=np.float32), sequence, timestamp)
+        sequence += 1
+        print(round(speed, 2))
     except Exception as e:
         print(e)
-        sock.close()
+        server.stop()
         exit(0)
 
+def marker_brightness(img):
+    '''
+        Mean of the binary thresholded region of interest, 0 (no marker) ... 255
+    '''
+    if ROI is not None:
+        x, y, width, height = ROI
+        img = img[y:y + height, x:x + width]
+    if LINE_SCAN_ROW is not None:
+        img = img[LINE_SCAN_ROW:LINE_SCAN_ROW + 1]
+    if DOWNSCALE > 1:
+        img = img[::DOWNSCALE, ::DOWNSCALE]
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    _, img = cv2.threshold(img, BINARY_THRESHOLD, 255, cv2.THRESH_BINARY)
+    return img.mean()
+
 def begin_measurement(client_socket):
     global is_marker, prev_time
+    index = 0
     while True:
-        _, img = cap.read()
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        _, img = cv2.threshold(img, 50, 255, cv2.THRESH_BINARY)
+        frame = camera.read(index)
+        if frame is None:
+            print("Camera stopped")
+            return
+        index, img, capture_time = frame
 
-        mean_white_val = img.mean()
+        mean_white_val = marker_brightness(img)
 
         # cv2.imshow("Test", img)
         # key = cv2.waitKey(1) & 0xFF
@@ -50,19 +85,23 @@ def begin_measurement(client_socket):
 
         if mean_white_val >= THRESHOLD and not is_marker:
             is_marker = True
-            cur_time = time.time()
-            # speed = 2.23694*BELT_LENGTH/(cur_time - prev_time)
-            speed = BELT_LENGTH/(cur_time - prev_time)
+            # the capture time excludes driver buffering and our own processing time
+            cur_time = capture_time
+            if prev_time is not None:
+                # speed = 2.23694*BELT_LENGTH/(cur_time - prev_time)
+                speed = BELT_LENGTH/(cur_time - prev_time)
+                send_speed(speed, client_socket, cur_time)
             prev_time = cur_time
-            send_speed(speed, client_socket)
         elif mean_white_val == 0:
             is_marker = False
 
 # Register Signal Handler
 def signal_handler(sig, frame):
-    sock.close()
+    if server is not None:
+        server.stop()
     # Release the capture
-    cap.release()
+    if camera is not None:
+        camera.release()
     cv2.destroyAllWindows()
     sys.exit(0)
 signal.signal(signal.SIGINT, signal_handler)
@@ -72,16 +111,21 @@ if __name__ == "__main__":
         print("Usage: python {command} <port>".format(command=sys.argv[0]))
         exit(0)
 
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
-    cap.set(cv2.CAP_PROP_FPS, FPS)
+    camera = CameraCapture(0, FRAME_WIDTH, FRAME_HEIGHT, FPS)
+    camera.start()
 
     PORT = int(sys.argv[1])
-    sock.bind((HOST, PORT))
+    server = StreamServer(HOST, PORT, QUEUE_SIZE, SLOW_CLIENT_POLICY, COALESCE_BYTES, LATENCY_BUDGET)
+    server.set_handshake(speed_config_packet())
+    server.start()
     print("Listening on port {port} ...".format(port=PORT))
-    sock.listen(1)
 
-    client_socket, client_addr = sock.accept()
-    print("Connected by: ", client_addr)
+    sink = server
+    if UDP_TARGET is not None:
+        datagram_sender = DatagramSender(*parse_address(UDP_TARGET))
+        datagram_sender.set_handshake(speed_config_packet())
+        sink = PacketTee(server, datagram_sender)
+        print("Streaming over UDP to {target}".format(target=UDP_TARGET))
 
-    begin_measurement(client_socket)
+    # speeds are fanned out to all connected clients
+    begin_measurement(sink)
@@ -0,0 +1,178 @@
+'''
+    Merges the radar stream and the speed stream into one stream in timestamp order.
+
+    Both sensors stamp their packets with timestamps.now() at capture, so when they run on
+    the same machine their header timestamps are directly comparable. The merger connects
+    to both servers as an ordinary client and holds every packet for a bounded reorder
+    window: a packet is forwarded once it is older than window seconds (or once more than
+    max_pending packets are held), always the oldest held packet first. A packet that
+    arrives after a newer one has already been forwarded is forwarded immediately and
+    counted as late, it is never dropped.
+
+    Consumers get a config packet with the configs of both sources under "sources", then
+    the binary packets of both sources interleaved. They are told apart by packet_type
+    (PACKET_SPEED for the speed samples). If a source is reconfigured, an updated merged
+    config packet is sent right away, ahead of the packets still in the reorder window.
+
+    Usage: python src/stream_merger.py <port> <radar_host:port> <speed_host:port> [window]
+'''
+import heapq
+import signal
+import socket
+import sys
+from threading import Condition, Thread
+import timestamps
+from radar_protocol import pack_json_packet, recv_json_packet, recv_message, wire_format
+from stream_server import StreamServer
+from udp_transport import parse_address
+
+# Constants
+HOST = "192.168.50.97" # Change this to raspberry Pi IP address (type "hostname -I" in rp terminal)
+QUEUE_SIZE = 64 # packets queued per client before the slow client policy applies
+SLOW_CLIENT_POLICY = "drop" # "drop" or "disconnect"
+COALESCE_BYTES = 65536 # packets waiting for a client are sent together in writes of up to this size
+LATENCY_BUDGET = 0.0 # [s] time a packet may wait for more packets to fill a write, 0 sends at once with TCP_NODELAY
+REORDER_WINDOW = 0.1 # [s]
+MAX_PENDING = 256 # packets
+
+class TimestampMerger:
+    def __init__(self, sink, window=REORDER_WINDOW, max_pending=MAX_PENDING):
+        '''
+            sink gets every packet in timestamp order through sink.sendall
+        '''
+        self.sink = sink
+        self.window = window
+        self.max_pending = max_pending
+        self.condition = Condition()
+        self.pending = []
+        self.count = 0 # tie breaker, keeps arrival order for equal timestamps
+        self.last_timestamp = float("-inf")
+        self.forwarded = 0
+        self.late = 0
+        self.running = True
+        self.thread = Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+
+    def push(self, timestamp, packet):
+        with self.condition:
+            if timestamp < self.last_timestamp:
+                # too late to be put in order, forwarding it now is better than dropping it
+                self.late += 1
+                self.forwarded += 1
+                self.sink.sendall(packet)
+                return
+            heapq.heappush(self.pending, (timestamp, self.count, packet))
+            self.count += 1
+            self.condition.notify()
+
+    def run(self):
+        with self.condition:
+            while self.running:
+                self.condition.wait_for(lambda: self.pending or not self.running)
+                if not self.running:
+                    break
+                delay = self.pending[0][0] + self.window - timestamps.now()
+                if delay > 0 and len(self.pending) <= self.max_pending:
+                    self.condition.wait(delay)
+                    continue
+                timestamp, _, packet = heapq.heappop(self.pending)
+                self.last_timestamp = timestamp
+                self.forwarded += 1
+                self.sink.sendall(packet)
+            # flush what is left, still in order
+            while self.pending:
+                self.sink.sendall(heapq.heappop(self.pending)[2])
+                self.forwarded += 1
+
+    def stats(self):
+        with self.condition:
+            return {
+                "pending": len(self.pending),
+                "forwarded": self.forwarded,
+                "late": self.late,
+            }
+
+def read_source(name, connection, merger, sources, server):
+    '''
+        Feeds the binary packets of one source into the merger until it disconnects
+    '''
+    try:
+        while True:
+            header, raw, payload = recv_message(connection)
+            if header is None:
+                # raw is the decoded JSON packet. Only config updates of the source change
+                # the merged handshake; its stats and control replies are not passed on
+                if raw.get("packet_type") == "config":
+                    sources[name] = raw
+                    server.update_handshake(merged_config_packet(sources))
+                continue
+            merger.push(header.timestamp, raw + payload)
+    except (ConnectionError, OSError) as e:
+        print(e)
+    finally:
+        connection.close()
+
+def merged_config_packet(sources):
+    return pack_json_packet({
+        "packet_type": "config",
+        "wire_format": wire_format(),
+        "clock": timestamps.clock_info(),
+        "stream": {"mode": "merged", "reorder_window": REORDER_WINDOW},
+        "sources": sources,
+    })
+
+# Global Variables
+server = None
+merger = None
+
+# Setup Signal Handler
+def signal_handler(sig, frame):
+    if merger is not None:
+        print(merger.stats())
+        merger.stop()
+    if server is not None:
+        server.stop()
+    exit(0)
+signal.signal(signal.SIGINT, signal_handler)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print("Usage: python {command} <port> <radar_host:port> <speed_host:port> [window]".format(command=sys.argv[0]))
+        exit(0)
+
+    PORT = int(sys.argv[1])
+    if len(sys.argv) > 4:
+        REORDER_WINDOW = float(sys.argv[4])
+
+    connections = {}
+    sources = {}
+    for name, address in (("radar", sys.argv[2]), ("speed", sys.argv[3])):
+        connections[name] = socket.create_connection(parse_address(address))
+        sources[name] = recv_json_packet(connections[name])
+        print("Connected to {name} at {address}".format(name=name, address=address))
+
+    server = StreamServer(HOST, PORT, QUEUE_SIZE, SLOW_CLIENT_POLICY, COALESCE_BYTES, LATENCY_BUDGET)
+    server.set_handshake(merged_config_packet(sources))
+    server.start()
+    print("Listening on port {port} ...".format(port=PORT))
+
+    merger = TimestampMerger(server, REORDER_WINDOW)
+    merger.start()
+    readers = [
+        Thread(target=read_source, args=(name, connection, merger, sources, server), daemon=True)
+        for name, connection in connections.items()
+    ]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+    merger.stop()
+    server.stop()
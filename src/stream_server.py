@@ -0,0 +1,359 @@
+'''
+    asyncio TCP server that fans packets from one acquisition source out to any number of
+    clients.
+
+    The server runs its event loop on a background thread. The acquisition side calls
+    sendall() / write_packet() from its own thread; these never block: the packet is handed
+    to the loop, which puts it on a bounded queue per client. Every client has its own
+    writer task, so a slow or stalled client only fills its own queue and is then handled
+    by the slow client policy:
+
+        "drop"          the oldest queued data packets of that client are dropped. Queued
+                        handshake / config packets are kept, the client needs them to
+                        decode the packets that follow
+        "disconnect"    the client is disconnected
+
+    Packets are kept as a tuple of buffers (header, payload) that are never concatenated.
+    A client's writer coalesces the packets waiting in its queue into one write of up to
+    coalesce_bytes, sent with scatter-gather sendmsg straight from the queued buffers
+    (VectoredWriter, StreamWriter.writelines would join them before Python 3.12). With a
+    latency_budget [s] it also waits up to that long after the first packet for more
+    packets to fill the write. This trades latency for fewer syscalls and larger TCP
+    segments. With a budget of 0 nothing is held back: only packets that are already queued
+    are coalesced, and TCP_NODELAY is set so the kernel does not delay small writes either.
+    Every write is timed into the "send" stage of telemetry.PIPELINE, and summed up per
+    client as send_seconds.
+
+    A handshake packet (e.g. the radar config packet) can be set and is sent to every new
+    client before any data. update_handshake() replaces it and also sends it to the connected
+    clients, in order with the data packets.
+
+    Clients may send JSON control packets (4 digit length prefix, like the config packet).
+    They are passed to the control handler on the event loop thread, which must not block.
+    Its return value is sent back to that client only as a JSON packet, an exception is
+    reported as {"packet_type": "control_error", "error": ...}.
+'''
+import asyncio
+import json
+import socket
+import time
+from threading import Thread, Event
+from radar_protocol import HEADER_LENGTH, ProtocolError, byte_views, consume_buffers, pack_json_packet
+from telemetry import PIPELINE
+
+DROP = "drop"
+DISCONNECT = "disconnect"
+SLOW_CLIENT_POLICIES = (DROP, DISCONNECT)
+IOV_MAX = 1024 # buffers per sendmsg call, the Linux limit
+
+class HandshakePacket(tuple):
+    '''
+        Queued handshake or config update, never dropped for a slow client
+    '''
+
+class VectoredWriter:
+    '''
+        Writes lists of buffers to the socket of a stream transport with sendmsg, without
+        joining them. The transport is then only used to read and to close the connection.
+    '''
+    def __init__(self, sock):
+        # get_extra_info("socket") has no sendmsg, a duplicate of the socket has
+        self.socket = sock.dup()
+        self.socket.setblocking(False)
+
+    async def write(self, buffers):
+        buffers = byte_views(buffers)
+        while buffers:
+            try:
+                sent = self.socket.sendmsg(buffers[:IOV_MAX])
+            except (BlockingIOError, InterruptedError):
+                await self.writable()
+                continue
+            consume_buffers(buffers, sent)
+
+    async def writable(self):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        fd = self.socket.fileno()
+        loop.add_writer(fd, lambda: future.done() or future.set_result(None))
+        try:
+            await future
+        finally:
+            loop.remove_writer(fd)
+
+    def close(self):
+        self.socket.close()
+
+class ClientConnection:
+    def __init__(self, reader, writer, queue_size):
+        self.reader = reader
+        self.writer = writer
+        self.address = writer.get_extra_info("peername")
+        sock = writer.get_extra_info("socket")
+        self.vectored = VectoredWriter(sock) if sock is not None and hasattr(socket.socket, "sendmsg") else None
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.sent = 0
+        self.writes = 0
+        self.send_time = 0.0
+        self.dropped = 0
+        self.closed = False
+        self.handler_task = None
+        self.writer_task = None
+
+    async def write(self, buffers):
+        if self.vectored is not None:
+            await self.vectored.write(buffers)
+        else:
+            self.writer.writelines(buffers)
+            await self.writer.drain()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            if self.vectored is not None:
+                self.vectored.close()
+            self.writer.close()
+
+class StreamServer:
+    def __init__(self, host, port, queue_size=64, slow_client_policy=DROP, coalesce_bytes=65536, latency_budget=0.0):
+        if slow_client_policy not in SLOW_CLIENT_POLICIES:
+            raise ValueError("Unknown slow client policy: {policy}".format(policy=slow_client_policy))
+        if latency_budget < 0:
+            raise ValueError("Negative latency budget: {budget}".format(budget=latency_budget))
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.slow_client_policy = slow_client_policy
+        self.coalesce_bytes = coalesce_bytes
+        self.latency_budget = latency_budget
+        self.handshake = None
+        self.control_handler = None
+        self.clients = []
+        self.disconnected_slow_clients = 0
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.started = Event()
+        self.error = None
+
+    def start(self):
+        '''
+            Starts listening on a background thread, returns once the socket is bound
+        '''
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.started.wait()
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.server = self.loop.run_until_complete(
+                asyncio.start_server(self.handle_client, self.host, self.port)
+            )
+        except Exception as e:
+            self.error = e
+            self.started.set()
+            return
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.server.close()
+            # the client tasks must finish before the loop is closed: the writers are
+            # cancelled, the handlers return once their connection is closed
+            tasks = []
+            for client in list(self.clients):
+                client.writer_task.cancel()
+                tasks.extend((client.handler_task, client.writer_task))
+                client.close()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.run_until_complete(self.server.wait_closed())
+            self.loop.close()
+
+    def stop(self):
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+
+    def set_handshake(self, packet):
+        '''
+            packet is sent to every client that connects from now on
+        '''
+        self.handshake = HandshakePacket((bytes(packet), ))
+
+    def set_control_handler(self, handler):
+        '''
+            handler(message) is called with every control message (dict) a client sends
+        '''
+        self.control_handler = handler
+
+    def update_handshake(self, packet):
+        '''
+            Sets a new handshake and sends it to the connected clients after the packets
+            queued so far, safe to call from any thread
+        '''
+        self.loop.call_soon_threadsafe(self.replace_handshake, HandshakePacket((bytes(packet), )))
+
+    # sink interface used by the acquisition thread
+
+    def sendall(self, packet):
+        '''
+            Queues one complete packet for every client, safe to call from any thread
+        '''
+        self.loop.call_soon_threadsafe(self.fan_out, (bytes(packet), ))
+
+    def write_packet(self, header, payload):
+        '''
+            Binary packet sink (see radar_protocol.send_packet). The payload is only valid
+            during the call and is sent from the loop thread, so a view (raw samples) is
+            copied once; bytes (compressed payloads) are used as they are. The payload is
+            shared by all clients and sent after the header without joining them.
+        '''
+        self.loop.call_soon_threadsafe(self.fan_out, (bytes(header), bytes(payload)))
+
+    # event loop side
+
+    async def handle_client(self, reader, writer):
+        client = ClientConnection(reader, writer, self.queue_size)
+        if self.latency_budget == 0:
+            sock = writer.get_extra_info("socket")
+            if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.handshake is not None:
+            client.queue.put_nowait(self.handshake)
+        self.clients.append(client)
+        print("Connected by: ", client.address)
+
+        client.handler_task = asyncio.current_task()
+        client.writer_task = asyncio.ensure_future(self.write_client(client))
+        try:
+            while True:
+                packet = await self.read_control_packet(reader)
+                self.queue_packet(client, (self.control(packet), ))
+        except asyncio.IncompleteReadError:
+            pass
+        except ProtocolError as e:
+            print("Closing {address}: {error}".format(address=client.address, error=e))
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            client.writer_task.cancel()
+            self.remove_client(client)
+
+    async def read_control_packet(self, reader):
+        packet_len = await reader.readexactly(HEADER_LENGTH)
+        if not packet_len.isdigit():
+            raise ProtocolError("Bad control packet length: {length}".format(length=packet_len))
+        return await reader.readexactly(int(packet_len))
+
+    def control(self, packet):
+        if self.control_handler is None:
+            return pack_json_packet({"packet_type": "control_error", "error": "No control handler"})
+        try:
+            reply = self.control_handler(json.loads(packet.decode('utf-8')))
+        except Exception as e:
+            return pack_json_packet({"packet_type": "control_error", "error": str(e)})
+        return pack_json_packet(reply or {"packet_type": "control_ack"})
+
+    async def write_client(self, client):
+        try:
+            while True:
+                buffers = list(await client.queue.get())
+                packets = 1
+                size = sum(len(buffer) for buffer in buffers)
+                deadline = self.loop.time() + self.latency_budget
+                while size < self.coalesce_bytes:
+                    if not client.queue.empty():
+                        packet = client.queue.get_nowait()
+                    else:
+                        timeout = deadline - self.loop.time()
+                        if timeout <= 0:
+                            break
+                        try:
+                            packet = await asyncio.wait_for(client.queue.get(), timeout)
+                        except asyncio.TimeoutError:
+                            break
+                    buffers.extend(packet)
+                    size += sum(len(buffer) for buffer in packet)
+                    packets += 1
+                start = time.perf_counter()
+                await client.write(buffers)
+                duration = time.perf_counter() - start
+                PIPELINE.histogram("send").observe(duration)
+                client.send_time += duration
+                client.sent += packets
+                client.writes += 1
+        except (ConnectionError, OSError):
+            self.remove_client(client)
+
+    def fan_out(self, packet):
+        for client in list(self.clients):
+            self.queue_packet(client, packet)
+
+    def queue_packet(self, client, packet):
+        if client.queue.full():
+            if self.slow_client_policy == DISCONNECT:
+                self.disconnected_slow_clients += 1
+                self.remove_client(client)
+                return
+            self.drop_oldest(client)
+        client.queue.put_nowait(packet)
+
+    def drop_oldest(self, client):
+        '''
+            Drops the oldest queued data packet of client, or the oldest handshake if only
+            handshakes are queued (a newer one follows)
+        '''
+        packets = [client.queue.get_nowait() for _ in range(client.queue.qsize())]
+        index = next((i for i, packet in enumerate(packets) if not isinstance(packet, HandshakePacket)), 0)
+        del packets[index]
+        for packet in packets:
+            client.queue.put_nowait(packet)
+        client.dropped += 1
+
+    def replace_handshake(self, packet):
+        self.handshake = packet
+        self.fan_out(packet)
+
+    def remove_client(self, client):
+        if client in self.clients:
+            self.clients.remove(client)
+            print("Disconnected: ", client.address)
+        client.close()
+
+    def metrics_samples(self):
+        '''
+            Gauge samples for telemetry.PIPELINE.add_collector
+        '''
+        samples = [
+            ("clients", {}, len(self.clients)),
+            ("disconnected_slow_clients", {}, self.disconnected_slow_clients),
+        ]
+        for client in self.stats()["clients"]:
+            labels = {"client": client["address"]}
+            samples.append(("client_queue_depth", labels, client["queue_depth"]))
+            samples.append(("client_sent_packets", labels, client["sent"]))
+            samples.append(("client_writes", labels, client["writes"]))
+            samples.append(("client_send_seconds", labels, client["send_seconds"]))
+            samples.append(("client_dropped_packets", labels, client["dropped"]))
+        return samples
+
+    def stats(self):
+        return {
+            "clients": [
+                {
+                    "address": "{0}:{1}".format(*client.address[:2]),
+                    "queue_depth": client.queue.qsize(),
+                    "sent": client.sent,
+                    "writes": client.writes,
+                    "send_seconds": client.send_time,
+                    "dropped": client.dropped,
+                }
+                for client in list(self.clients)
+            ],
+            "disconnected_slow_clients": self.disconnected_slow_clients,
+        }
@@ -0,0 +1,238 @@
+'''
+    Live pipeline metrics.
+
+    The pipeline stages time themselves into latency histograms of the process wide
+    registry PIPELINE:
+
+        device_wait     Device.get_next_frame (including overflow recovery)
+        extraction      copying the enabled antennas / chirps out of the SDK frame
+        dsp             range FFT, range-Doppler map or vital signs processing
+        serialization   payload encoding and header packing
+        sink            handing the packet to a packet sink (a StreamServer only queues it)
+        send            writing to a socket: send_packet on a plain socket, or one coalesced
+                        write of a StreamServer client
+        latency         frame acquisition to send (from the packet timestamp)
+
+    Counters of packets and bytes sent go with them. Components with their own statistics
+    (server queues, ring buffer and overflow drops) are added as collectors, functions that
+    return (name, labels, value) gauge samples when the metrics are read.
+
+    MetricsHTTPServer serves the registry in the Prometheus text format, StatsSender sends a
+    JSON "stats" packet with a summary to a packet sink (e.g. the StreamServer) periodically.
+'''
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread
+import time
+import timestamps
+
+LATENCY_BUCKETS = (
+    50.0e-6, 100.0e-6, 250.0e-6, 500.0e-6, 1.0e-3, 2.5e-3, 5.0e-3, 10.0e-3, 25.0e-3, 50.0e-3, 100.0e-3, 250.0e-3, 1.0
+) # [s]
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+        self.lock = Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+            if value > self.max:
+                self.max = value
+
+    def quantile(self, q):
+        '''
+            Upper bound of the bucket holding the q quantile, at most the maximum
+        '''
+        with self.lock:
+            rank = q * self.count
+            total = 0
+            for bound, count in zip(self.buckets + (self.max, ), self.counts):
+                total += count
+                if total >= rank and total:
+                    return min(bound, self.max)
+        return 0.0
+
+class StageTimer:
+    '''
+        Context manager observing the duration of a stage
+    '''
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+class PipelineMetrics:
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.collectors = []
+        self.lock = Lock()
+        self.start_time = timestamps.now()
+
+    def histogram(self, stage):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(stage, Histogram())
+        return histogram
+
+    def timer(self, stage):
+        '''
+            with PIPELINE.timer("dsp"): ...
+        '''
+        return StageTimer(self.histogram(stage))
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_collector(self, collector):
+        '''
+            collector() returns an iterable of (name, labels dict, value) gauge samples
+        '''
+        self.collectors.append(collector)
+
+    def collect(self):
+        samples = []
+        for collector in list(self.collectors):
+            try:
+                samples.extend(collector())
+            except Exception as e:
+                print("Metrics collector failed: {error}".format(error=e))
+        return samples
+
+    def prometheus(self):
+        '''
+            All metrics in the Prometheus text exposition format
+        '''
+        lines = []
+        lines.append("# TYPE radar_stage_seconds histogram")
+        for stage, histogram in sorted(list(self.histograms.items())):
+            with histogram.lock:
+                total = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    total += count
+                    lines.append('radar_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {value}'.format(stage=stage, le=bound, value=total))
+                lines.append('radar_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {value}'.format(stage=stage, value=histogram.count))
+                lines.append('radar_stage_seconds_sum{{stage="{stage}"}} {value}'.format(stage=stage, value=histogram.sum))
+                lines.append('radar_stage_seconds_count{{stage="{stage}"}} {value}'.format(stage=stage, value=histogram.count))
+        with self.lock:
+            counters = sorted(self.counters.items())
+        for name, value in counters:
+            lines.append("# TYPE radar_{name} counter".format(name=name))
+            lines.append("radar_{name} {value}".format(name=name, value=value))
+        typed = set()
+        for name, labels, value in self.collect():
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE radar_{name} gauge".format(name=name))
+            label_text = ",".join('{0}="{1}"'.format(key, label) for key, label in sorted(labels.items()))
+            if label_text:
+                label_text = "{" + label_text + "}"
+            lines.append("radar_{name}{labels} {value}".format(name=name, labels=label_text, value=value))
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        '''
+            Compact summary for the stats packet, times in us
+        '''
+        stages = {}
+        for stage, histogram in sorted(list(self.histograms.items())):
+            if histogram.count:
+                stages[stage] = {
+                    "count": histogram.count,
+                    "mean_us": round(1.0e6 * histogram.sum / histogram.count, 1),
+                    "p99_us": round(1.0e6 * histogram.quantile(0.99), 1),
+                    "max_us": round(1.0e6 * histogram.max, 1),
+                }
+        with self.lock:
+            counters = dict(self.counters)
+        gauges = {}
+        for name, labels, value in self.collect():
+            key = name if not labels else name + "{" + ",".join("{0}={1}".format(*item) for item in sorted(labels.items())) + "}"
+            gauges[key] = value
+        return {"uptime": timestamps.now() - self.start_time, "stages": stages, "counters": counters, "gauges": gauges}
+
+PIPELINE = PipelineMetrics()
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class MetricsHTTPServer:
+    '''
+        Serves GET /metrics on a background thread
+    '''
+    def __init__(self, host, port, registry=PIPELINE):
+        self.httpd = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        self.httpd.registry = registry
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.thread = Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class StatsSender(Thread):
+    '''
+        Sends a {"packet_type": "stats", ...} JSON packet to sink.sendall every interval
+        seconds, with frames/s and bytes/s over the last interval
+    '''
+    def __init__(self, sink, interval=5.0, registry=PIPELINE):
+        super().__init__(daemon=True)
+        self.sink = sink
+        self.interval = interval
+        self.registry = registry
+        self.stopped = Event()
+
+    def run(self):
+        # imported here, radar_protocol imports this module
+        from radar_protocol import ProtocolError, pack_json_packet
+        previous = {}
+        while not self.stopped.wait(self.interval):
+            summary = self.registry.summary()
+            counters = summary["counters"]
+            summary["rates"] = {
+                name + "_per_s": (value - previous.get(name, 0)) / self.interval
+                for name, value in counters.items()
+            }
+            previous = counters
+            summary["packet_type"] = "stats"
+            try:
+                self.sink.sendall(pack_json_packet(summary))
+            except ProtocolError as e:
+                print("Stats packet not sent: {error}".format(error=e))
+            except (ConnectionError, OSError):
+                return
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,21 @@
+'''
+    Shared acquisition clock.
+
+    Radar frames and speed samples are stamped with time.monotonic() at capture. On Linux
+    this is CLOCK_MONOTONIC, which is the same for every process on the host, so stamps from
+    radar_sensor.py and speed_sensor.py are directly comparable, and it does not jump when
+    NTP adjusts the wall clock. The V4L2 camera driver stamps buffers with the same clock.
+
+    Config packets carry clock_info() so a client can convert stamps to wall time.
+'''
+import time
+
+def now():
+    return time.monotonic()
+
+def clock_info():
+    return {
+        "clock": "monotonic",
+        # add to a timestamp to get seconds since the epoch
+        "wall_offset": time.time() - time.monotonic(),
+    }
@@ -0,0 +1,265 @@
+'''
+    Datagram (UDP unicast or multicast) transport for live display.
+
+    TCP delivers every packet, so a short Wi-Fi outage stalls the stream and the backlog
+    arrives late. Over UDP a lost datagram loses its packet and the stream goes on. A
+    multicast group serves any number of receivers with the same datagrams, at no extra
+    cost to the sensor. TCP (StreamServer) stays the reliable transport for recording.
+
+    Every packet of the TCP stream (JSON or binary header and payload) is sent as one or
+    more datagrams. Each datagram starts with a fragment header:
+
+        magic           4s  FRAGMENT_MAGIC
+        stream id       I   random per sender, a change means the sender restarted
+        packet id       I   consecutive per packet, gaps are lost packets
+        index           H   fragment index
+        count           H   number of fragments of the packet
+        length          I   packet length [bytes]
+
+    and carries the next max_datagram - FRAGMENT_SIZE bytes of the packet, sent with
+    sendmsg straight from the header and payload buffers. Sequence number and timestamp
+    are in the binary packet header. UDP has no connection to send a handshake on, so the
+    config packet is repeated every handshake_interval seconds and on every update.
+
+    Reassembler (used by receiver.UdpReceiver) puts the fragments back together. It
+    delivers the newest packets: when a packet is complete, older incomplete packets are
+    given up on and counted as lost.
+'''
+from threading import Lock
+import ipaddress
+import os
+import socket
+import struct
+import timestamps
+
+FRAGMENT_MAGIC = b"RTVU"
+FRAGMENT_STRUCT = struct.Struct('<4sIIHHI')
+FRAGMENT_SIZE = FRAGMENT_STRUCT.size
+MAX_DATAGRAM = 1472 # fits a 1500 byte Ethernet MTU with the IPv4 and UDP headers
+MULTICAST_TTL = 1 # multicast stays on the local network
+
+def is_multicast(host):
+    try:
+        return ipaddress.ip_address(host).is_multicast
+    except ValueError:
+        return False
+
+def parse_address(address):
+    '''
+        "host:port" to (host, port)
+    '''
+    host, _, port = address.rpartition(":")
+    return host, int(port)
+
+def fragments(buffers, fragment_size):
+    '''
+        Splits the concatenation of buffers into lists of memoryviews of at most
+        fragment_size bytes, without copying
+    '''
+    current, size = [], 0
+    for buffer in buffers:
+        view = memoryview(buffer).cast("B")
+        while len(view):
+            part = view[:fragment_size - size]
+            current.append(part)
+            size += len(part)
+            view = view[len(part):]
+            if size == fragment_size:
+                yield current
+                current, size = [], 0
+    if current:
+        yield current
+
+class DatagramSender:
+    '''
+        Packet sink sending every packet to a UDP unicast address or multicast group, safe
+        to call from any thread. Send errors lose the packet and are counted.
+    '''
+    def __init__(self, host, port, max_datagram=MAX_DATAGRAM, handshake_interval=1.0, ttl=MULTICAST_TTL):
+        if max_datagram <= FRAGMENT_SIZE:
+            raise ValueError("Datagram size {size} leaves no room for data".format(size=max_datagram))
+        self.address = (host, port)
+        self.max_datagram = max_datagram
+        self.handshake_interval = handshake_interval
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if is_multicast(host):
+            self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+            self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        self.stream_id = struct.unpack('<I', os.urandom(4))[0]
+        self.packet_id = 0
+        self.handshake = None
+        self.last_handshake = None
+        self.lock = Lock()
+        self.packets = 0
+        self.datagrams = 0
+        self.send_errors = 0
+
+    def set_handshake(self, packet):
+        '''
+            packet is sent before the next packet and then every handshake_interval
+        '''
+        with self.lock:
+            self.handshake = bytes(packet)
+            self.last_handshake = None
+
+    def update_handshake(self, packet):
+        '''
+            New config, sent at once and then repeated
+        '''
+        with self.lock:
+            self.handshake = bytes(packet)
+            self.repeat_handshake(force=True)
+
+    # sink interface, like StreamServer
+
+    def sendall(self, packet):
+        self.send((packet, ))
+
+    def write_packet(self, header, payload):
+        self.send((header, payload))
+
+    def send(self, buffers):
+        with self.lock:
+            self.repeat_handshake()
+            self.send_datagrams(buffers)
+
+    def repeat_handshake(self, force=False):
+        if self.handshake is None:
+            return
+        now = timestamps.now()
+        if force or self.last_handshake is None or now - self.last_handshake >= self.handshake_interval:
+            self.last_handshake = now
+            self.send_datagrams((self.handshake, ))
+
+    def send_datagrams(self, buffers):
+        length = sum(memoryview(buffer).nbytes for buffer in buffers)
+        fragment_size = self.max_datagram - FRAGMENT_SIZE
+        count = max(1, -(-length // fragment_size))
+        if count > 0xFFFF:
+            raise ValueError("Packet of {length} bytes needs too many datagrams".format(length=length))
+        packet_id = self.packet_id
+        self.packet_id = (self.packet_id + 1) & 0xFFFFFFFF
+        self.packets += 1
+        for index, parts in enumerate(fragments(buffers, fragment_size)):
+            fragment_header = FRAGMENT_STRUCT.pack(FRAGMENT_MAGIC, self.stream_id, packet_id, index, count, length)
+            try:
+                self.socket.sendmsg([fragment_header] + parts, [], 0, self.address)
+                self.datagrams += 1
+            except OSError:
+                # e.g. ENOBUFS or no route while the link is down, the packet is lost
+                self.send_errors += 1
+                return
+
+    def close(self):
+        self.socket.close()
+
+    def metrics_samples(self):
+        '''
+            Gauge samples for telemetry.PIPELINE.add_collector
+        '''
+        labels = {"address": "{0}:{1}".format(*self.address)}
+        return [
+            ("udp_sent_packets", labels, self.packets),
+            ("udp_sent_datagrams", labels, self.datagrams),
+            ("udp_send_errors", labels, self.send_errors),
+        ]
+
+class PacketTee:
+    '''
+        Packet sink passing every packet to several sinks, e.g. a StreamServer for
+        recording and a DatagramSender for live display
+    '''
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def sendall(self, packet):
+        for sink in self.sinks:
+            sink.sendall(packet)
+
+    def write_packet(self, header, payload):
+        for sink in self.sinks:
+            sink.write_packet(header, payload)
+
+    def update_handshake(self, packet):
+        for sink in self.sinks:
+            if hasattr(sink, "update_handshake"):
+                sink.update_handshake(packet)
+            else:
+                sink.sendall(packet)
+
+class Reassembly:
+    def __init__(self, count, length):
+        self.buffer = bytearray(length)
+        self.received = [False] * count
+        self.missing = count
+
+class Reassembler:
+    '''
+        Puts fragmented packets back together. add() takes one datagram and returns the
+        complete packet (a bytearray) once its last fragment arrived, else None.
+    '''
+    def __init__(self, max_pending=16):
+        self.max_pending = max_pending
+        self.stream_id = None
+        self.next_id = 0 # packets before this id are delivered or lost
+        self.pending = {}
+        self.packets = 0
+        self.lost = 0
+        self.late = 0
+        self.restarts = 0
+        self.last_gap = 0
+
+    def add(self, datagram):
+        if len(datagram) < FRAGMENT_SIZE:
+            return None
+        magic, stream_id, packet_id, index, count, length = FRAGMENT_STRUCT.unpack_from(datagram)
+        if magic != FRAGMENT_MAGIC or index >= count:
+            return None
+        if stream_id != self.stream_id:
+            if self.stream_id is not None:
+                self.restarts += 1
+            self.stream_id = stream_id
+            self.next_id = packet_id
+            self.pending.clear()
+        # ids are compared modulo 2 ** 32
+        age = (self.next_id - packet_id) & 0xFFFFFFFF
+        if 0 < age < 0x80000000:
+            self.late += 1
+            return None
+
+        reassembly = self.pending.get(packet_id)
+        if reassembly is None:
+            if len(self.pending) >= self.max_pending:
+                # the oldest incomplete packet is given up, it counts as lost once a newer one completes
+                del self.pending[min(self.pending, key=lambda pending_id: (pending_id - self.next_id) & 0xFFFFFFFF)]
+            reassembly = self.pending[packet_id] = Reassembly(count, length)
+        if len(reassembly.received) != count or len(reassembly.buffer) != length or reassembly.received[index]:
+            return None
+        # all fragments but the last one are full size
+        fragment_size = len(datagram) - FRAGMENT_SIZE
+        start = index * fragment_size if index < count - 1 else length - fragment_size
+        if start < 0 or start + fragment_size > length:
+            return None
+        reassembly.buffer[start:start + fragment_size] = memoryview(datagram)[FRAGMENT_SIZE:]
+        reassembly.received[index] = True
+        reassembly.missing -= 1
+        if reassembly.missing:
+            return None
+
+        del self.pending[packet_id]
+        self.last_gap = (packet_id - self.next_id) & 0xFFFFFFFF
+        for pending_id in [pending_id for pending_id in self.pending if ((pending_id - self.next_id) & 0xFFFFFFFF) < self.last_gap]:
+            del self.pending[pending_id]
+        self.lost += self.last_gap
+        self.next_id = (packet_id + 1) & 0xFFFFFFFF
+        self.packets += 1
+        return reassembly.buffer
+
+    def stats(self):
+        return {
+            "packets": self.packets,
+            "lost": self.lost,
+            "late": self.late,
+            "incomplete": len(self.pending),
+            "restarts": self.restarts,
+        }
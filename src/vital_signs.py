@@ -0,0 +1,125 @@
+'''
+    Streaming breathing and heart rate estimation from range FFT output.
+
+    Every frame contributes one complex sample per range bin (the range spectrum averaged
+    over chirps of the first antenna), kept in a ring buffer covering window_seconds of
+    slow time. At every update interval the subject's range bin is picked as the bin in
+    [min_range, max_range] with the most slow-time motion energy, its phase is unwrapped
+    into chest displacement and band-pass filtered into the breathing and heart bands.
+    The dominant frequency of each band is the rate estimate, its confidence is the share
+    of band energy around that peak.
+'''
+from collections import namedtuple
+from scipy.fft import rfft, next_fast_len
+from scipy import signal
+import numpy as np
+from dsp_plan import butter_sos
+from radar_tools import C
+
+BREATHING_BAND = (0.1, 0.6) # Hz
+HEART_BAND = (0.8, 3.0) # Hz
+
+VitalSigns = namedtuple(
+    'VitalSigns',
+    ['timestamp', 'distance', 'breathing_rate', 'breathing_confidence', 'heart_rate', 'heart_confidence']
+)
+VITAL_SIGNS_FIELDS = list(VitalSigns._fields)
+
+class VitalSignExtractor:
+    def __init__(
+        self,
+        radar_metrics,
+        range_axis,
+        window_seconds=20.0,
+        update_interval=1.0,
+        breathing_band=BREATHING_BAND,
+        heart_band=HEART_BAND,
+        filter_order=4,
+        min_fft_size=2048,
+    ):
+        '''
+            range_axis is the distance [m] of every range bin of the spectra passed to
+            add_frame (DigitalSignalProcessor.range_axis()). Rates are in breaths/beats
+            per minute.
+        '''
+        self.radar_metrics = radar_metrics
+        self.frame_rate = radar_metrics.frame_rate
+        self.window_length = int(round(window_seconds * self.frame_rate))
+        self.update_length = max(1, int(round(update_interval * self.frame_rate)))
+        self.wavelength = C / radar_metrics.center_frequency
+        self.range_axis = np.asarray(range_axis)
+        self.candidate_bins = np.flatnonzero(
+            (self.range_axis >= radar_metrics.min_range) & (self.range_axis <= radar_metrics.max_range)
+        )
+        if len(self.candidate_bins) == 0:
+            raise ValueError("No range bin between min_range and max_range")
+        self.candidate_slice = slice(self.candidate_bins[0], self.candidate_bins[-1] + 1)
+
+        nyquist = 0.5 * self.frame_rate
+        if heart_band[1] >= nyquist:
+            raise ValueError("The frame rate is too low for the heart band")
+        self.breathing_sos = butter_sos(filter_order, tuple(breathing_band), 'bandpass', self.frame_rate)
+        self.heart_sos = butter_sos(filter_order, tuple(heart_band), 'bandpass', self.frame_rate)
+        self.fft_size = next_fast_len(max(min_fft_size, self.window_length), real=True)
+        self.frequencies = np.arange(self.fft_size // 2 + 1) * (self.frame_rate / self.fft_size)
+        self.breathing_bins = np.flatnonzero((self.frequencies >= breathing_band[0]) & (self.frequencies <= breathing_band[1]))
+        self.heart_bins = np.flatnonzero((self.frequencies >= heart_band[0]) & (self.frequencies <= heart_band[1]))
+        self.spectral_window = signal.get_window("hann", self.window_length)
+
+        self.history = np.zeros((self.window_length, len(self.candidate_bins)), dtype=np.complex64)
+        self.num_frames = 0
+        self.range_bin = None
+
+    def add_frame(self, range_spectrum, timestamp):
+        '''
+            range_spectrum is the (rx, chirps, bins) or (chirps, bins) output of range_fft.
+            Returns a VitalSigns estimate every update interval once the window is full,
+            else None.
+        '''
+        if range_spectrum.ndim == 3:
+            range_spectrum = range_spectrum[0]
+        np.mean(range_spectrum[:, self.candidate_slice], axis=0, out=self.history[self.num_frames % self.window_length])
+        self.num_frames += 1
+
+        if self.num_frames < self.window_length or self.num_frames % self.update_length:
+            return None
+        return self.estimate(timestamp)
+
+    def estimate(self, timestamp):
+        # oldest sample first
+        start = self.num_frames % self.window_length
+        window = np.roll(self.history, -start, axis=0)
+
+        # the subject moves, static clutter does not: pick the bin with the most variance
+        motion = np.var(window, axis=0)
+        best = int(np.argmax(motion))
+        self.range_bin = int(self.candidate_bins[best])
+
+        phase = np.unwrap(np.angle(window[:, best]).astype(np.float64))
+        displacement = signal.detrend(phase) * self.wavelength / (4.0 * np.pi)
+
+        breathing_rate, breathing_confidence = self.band_rate(self.breathing_sos, self.breathing_bins, displacement)
+        heart_rate, heart_confidence = self.band_rate(self.heart_sos, self.heart_bins, displacement)
+        return VitalSigns(
+            timestamp,
+            float(self.range_axis[self.range_bin]),
+            breathing_rate,
+            breathing_confidence,
+            heart_rate,
+            heart_confidence,
+        )
+
+    def band_rate(self, sos, bins, displacement):
+        '''
+            Returns (rate [1/min], confidence in [0, 1]) of the strongest component in band
+        '''
+        band_signal = signal.sosfiltfilt(sos, displacement)
+        power = np.abs(rfft(band_signal * self.spectral_window, n=self.fft_size)[bins])**2
+        total = power.sum()
+        if total <= 0:
+            return 0.0, 0.0
+        peak = int(np.argmax(power))
+        # energy within one Hann main lobe of the peak
+        lobe = max(1, int(2 * self.fft_size / self.window_length))
+        confidence = power[max(0, peak - lobe):peak + lobe + 1].sum() / total
+        return float(60.0 * self.frequencies[bins[peak]]), float(confidence)